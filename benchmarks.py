@@ -0,0 +1,733 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Benchmarks
+"""
+Small, self-contained measurements for the performance work in this repo. Each benchmark is a function
+returning a dict of numbers, and can be run from the command line:
+
+`python benchmarks.py import-time`
+`python benchmarks.py import-time --ref <git ref>`    compare with an older version of the repo
+`python benchmarks.py lookup-index --rows 1000000`
+`python benchmarks.py async-vs-threads --requests 5000 --concurrency 100`
+`python benchmarks.py loader-strategies --users 10000 --url sqlite://`
+`python benchmarks.py projections --users 100000 --url sqlite://`
+`python benchmarks.py paths --rows 1000 100000 1000000 --output bench_paths.json`
+`python benchmarks.py statements --calls 100000`
+`python benchmarks.py prepared --queries 20000`
+`python benchmarks.py coalescer --rows 20000 --writers 50 --batch-sizes 1 10 100 500`
+
+Benchmarks that need a database use the engine from keys.get_engine() (set DATABASE_URL to try SQLite),
+and only ever write to their own bench_* tables (or create some_table if it doesn't exist).
+Benchmarks that need the real user_account/address tables filled with data take a --url of a scratch
+database in stead (an in-memory SQLite database by default), and create the tables there.
+"""
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _print_json(result) -> None:
+    print(json.dumps(result, indent=2, default=str))
+
+
+# Cold import cost
+"""
+Every module is imported in a fresh interpreter, so nothing is cached in sys.modules. With --ref the
+files of that git revision are exported to a temporary directory and timed the same way, which shows
+what importing used to cost (or that it failed, when no database was reachable).
+"""
+IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def _time_import(module: str, cwd: str, repeat: int) -> Dict[str, object]:
+    timings = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+            cwd=cwd, capture_output=True, text=True, timeout=120,
+        )
+        if proc.returncode != 0:
+            # The exception line, not the "(Background on this error ...)" footer
+            lines = [l for l in proc.stderr.splitlines() if l and not l.startswith((" ", "("))]
+            return {"error": (lines or ["?"])[-1][:200]}
+        timings.append(float(proc.stdout.strip().splitlines()[-1]))
+    return {"median_seconds": statistics.median(timings), "min_seconds": min(timings)}
+
+
+def bench_import_time(modules: Sequence[str] = ("keys", "core_metadata", "core", "orm"),
+                      ref: Optional[str] = None, repeat: int = 5) -> Dict[str, Dict[str, object]]:
+    """Cold import time of each module, for the working tree and optionally for git revision `ref`."""
+    results = {"working tree": {m: _time_import(m, REPO_DIR, repeat) for m in modules}}
+    if ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = subprocess.run(["git", "archive", ref], cwd=REPO_DIR, capture_output=True, check=True)
+            subprocess.run(["tar", "-x", "-C", tmp], input=archive.stdout, check=True)
+            results[ref] = {m: _time_import(m, tmp, repeat) for m in modules}
+    return results
+
+
+def _latency(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Calls `fn` `repeat` times and returns p50/p99 latency in milliseconds."""
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": timings[len(timings) // 2],
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    }
+
+
+# Lookup latency with and without the secondary indexes
+"""
+Fills a scratch copy of user_account with `rows` users, times point lookups on name, then adds the same
+index that core_metadata.py declares and times the lookups again.
+"""
+def bench_lookup_index(rows: int = 1_000_000, lookups: int = 50, engine=None) -> Dict[str, object]:
+    from keys import get_engine
+    from sqlalchemy import MetaData, Table, Column, Integer, String, Index, insert, select
+
+    engine = engine or get_engine("batch")
+    metadata = MetaData()
+    bench_table = Table(
+        "bench_user_account",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("name", String(30)),
+        Column("fullname", String(255)),
+    )
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    try:
+        with engine.begin() as conn:
+            for start in range(0, rows, 10_000):
+                conn.execute(insert(bench_table), [
+                    {"name": f"user{i}", "fullname": f"User Number {i}"}
+                    for i in range(start, min(start + 10_000, rows))
+                ])
+
+        stmt = select(bench_table).where(bench_table.c.name == f"user{rows // 2}")
+        with engine.connect() as conn:
+            without_index = _latency(lambda: conn.execute(stmt).all(), lookups)
+            index = Index("ix_bench_user_account_name", bench_table.c.name)
+            index.create(conn)
+            conn.commit()
+            with_index = _latency(lambda: conn.execute(stmt).all(), lookups)
+    finally:
+        metadata.drop_all(engine)
+    return {"rows": rows, "without_index": without_index, "with_index": with_index}
+
+
+# Concurrent requests: asyncio vs. a thread pool
+"""
+The same point lookup (the statement of select_all_from_some_table_where_x_is) served `requests` times with
+`concurrency` requests in flight: once with an AsyncEngine on one event loop, once with a blocking Engine through
+run_in_executor on a thread pool, which is what an asyncio service has to do with blocking functions.
+
+Both engines get their own pool of exactly `concurrency` connections (and no overflow), so neither side waits
+for a connection and the numbers compare asyncio with threads, not two pool sizes.
+"""
+def bench_async_vs_threads(requests: int = 5000, concurrency: int = 100) -> Dict[str, Dict[str, float]]:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.ext.asyncio import create_async_engine
+    import core
+    from keys import ASYNC_DRIVERS, get_connection_string
+    from statements import SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS
+
+    core.create_some_table()
+    url = make_url(get_connection_string())
+    async_url = url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}")
+    pool = {"pool_size": concurrency, "max_overflow": 0}
+
+    async def run_async() -> float:
+        engine = create_async_engine(async_url, **pool)
+        async def lookup(x: int) -> None:
+            async with engine.connect() as conn:
+                (await conn.execute(SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS, {"x": x})).all()
+        semaphore = asyncio.Semaphore(concurrency)
+        async def one(i: int) -> None:
+            async with semaphore:
+                await lookup(i % 100)
+        await lookup(0) # warm up the pool
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+        await engine.dispose()
+        return elapsed
+
+    async def run_threads() -> float:
+        engine = create_engine(url, **pool)
+        def lookup(x: int) -> None:
+            with engine.connect() as conn:
+                conn.execute(SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS, {"x": x}).all()
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            await loop.run_in_executor(executor, lookup, 0)
+            start = time.perf_counter()
+            await asyncio.gather(*(loop.run_in_executor(executor, lookup, i % 100) for i in range(requests)))
+            elapsed = time.perf_counter() - start
+        engine.dispose()
+        return elapsed
+
+    results = {}
+    for name, runner in (("asyncio", run_async), ("thread_pool", run_threads)):
+        seconds = asyncio.run(runner())
+        results[name] = {"seconds": seconds, "requests_per_second": requests / seconds, "pool_size": concurrency}
+    return results
+
+
+def _count_statements(engine) -> List[int]:
+    """Returns a one-element list that is incremented for every statement executed on `engine`."""
+    from sqlalchemy import event
+    counter = [0]
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(*args):
+        counter[0] += 1
+    return counter
+
+
+# N+1: relationship loading strategies
+"""
+Loads `users` users with `addresses_per_user` addresses each through the ORM and touches user.addresses on every
+one of them, once per loader strategy in orm.LOADER_STRATEGIES ("raise" is left out, it raises on the first access).
+"""
+def bench_loader_strategies(users: int = 10_000, addresses_per_user: int = 5, url: str = "sqlite://") -> Dict[str, Dict[str, float]]:
+    from sqlalchemy import create_engine, insert, select
+    from sqlalchemy.orm import Session
+    from orm_metadata import Base, User, Address
+    from orm import loader_option
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": i, "name": f"user{i}", "fullname": f"User {i}"} for i in range(1, users + 1)])
+        conn.execute(insert(Address), [
+            {"user_id": i, "email_address": f"user{i}.{n}@example.org"}
+            for i in range(1, users + 1) for n in range(addresses_per_user)
+        ])
+
+    counter = _count_statements(engine)
+    results = {}
+    for loader in ("lazy", "selectin", "joined", "subquery"):
+        counter[0] = 0
+        start = time.perf_counter()
+        with Session(engine) as session:
+            user_objects = session.scalars(select(User).options(loader_option(loader, User.addresses))).unique().all()
+            total = sum(len(user_obj.addresses) for user_obj in user_objects)
+        results[loader] = {
+            "queries": counter[0],
+            "seconds": time.perf_counter() - start,
+            "addresses": total,
+        }
+    engine.dispose()
+    return results
+
+
+# ORM objects vs. read-only projections
+"""
+Reads all users once as ORM User objects and once as projections.UserView tuples, and reports rows/sec and the
+memory held per row (traced by tracemalloc while the whole list is alive).
+"""
+def bench_projections(users: int = 100_000, url: str = "sqlite://") -> Dict[str, Dict[str, float]]:
+    import tracemalloc
+    from sqlalchemy import create_engine, insert, select
+    from sqlalchemy.orm import Session
+    from orm_metadata import Base, User
+    from projections import UserView
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"name": f"user{i}", "fullname": f"User Number {i}"} for i in range(users)])
+
+    def orm_objects():
+        with Session(engine) as session:
+            user_objects = session.scalars(select(User)).all()
+            session.expunge_all()
+            return user_objects
+
+    def projection():
+        stmt = select(User.id, User.name, User.fullname)
+        with engine.connect() as conn:
+            return list(map(UserView._make, conn.execute(stmt)))
+
+    results = {}
+    for name, load in (("orm", orm_objects), ("projection", projection)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        loaded = load()
+        seconds = time.perf_counter() - start
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = {"rows_per_second": len(loaded) / seconds, "bytes_per_row": held / len(loaded)}
+        del loaded
+    engine.dispose()
+    return results
+
+
+# text() vs. Core vs. ORM, for every operation
+"""
+The repo does the same things three ways: raw SQL with text() (core.py), Core expressions like insert(user_table)
+and select(user_table) (core.py), and the ORM with select(User) and session.add() (orm.py). This benchmark runs
+the same five operations through each of the three paths, on fresh user_account/address tables filled with `rows`
+users (and one address per user):
+
+* executemany: inserting all `rows` users in chunks of 10_000 rows, one commit per chunk
+  (the ORM path uses session.add_all(), i.e. the unit of work)
+* single_insert: up to 1000 more users, one INSERT and one commit each
+* point_select: `lookups` lookups of one user by name (an indexed column), the names drawn with `seed`
+* full_scan: reading all users
+* join: reading all users with their address
+
+Each operation reports rows/sec, p50/p99 latency in ms (per statement, chunk or scan) and peak_bytes: the peak
+memory allocated by one more run of the operation (one chunk for executemany) under tracemalloc. That run isn't
+timed, because tracemalloc slows the ORM down much more than text() and Core.
+
+It runs on an in-memory SQLite database and, when the local MySQL container is reachable (see keys.py), on a
+scratch database `sqlalchemy_demo_bench` on that server, which is created if needed. The results are written
+to `output` as JSON, with the SQLAlchemy version and git revision, so two runs can be diffed.
+"""
+PATHS = ("text", "core", "orm")
+BENCH_MYSQL_DATABASE = "sqlalchemy_demo_bench"
+
+
+def _mysql_scratch_url() -> Optional[str]:
+    """The URL of the scratch database on the local MySQL server, or None when there is no such server."""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.exc import SQLAlchemyError
+    from keys import get_connection_string
+
+    url = make_url(get_connection_string())
+    if url.get_backend_name() != "mysql":
+        return None
+    engine = create_engine(url.set(database=None), connect_args={"connect_timeout": 2})
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(f"CREATE DATABASE IF NOT EXISTS {BENCH_MYSQL_DATABASE}"))
+    except SQLAlchemyError:
+        return None
+    finally:
+        engine.dispose()
+    return url.set(database=BENCH_MYSQL_DATABASE).render_as_string(hide_password=False)
+
+
+def _percentiles(timings: List[float]) -> Dict[str, float]:
+    timings = sorted(timings)
+    return {
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+    }
+
+
+def _peak_bytes(fn: Callable[[], object]) -> int:
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _measure(calls: Sequence[Callable[[], int]], memory_call: Callable[[], object]) -> Dict[str, float]:
+    """Times every call (each returns the number of rows it handled), then measures memory with `memory_call`."""
+    timings = []
+    rows = 0
+    for call in calls:
+        start = time.perf_counter()
+        rows += call()
+        timings.append(time.perf_counter() - start)
+    return {
+        "rows": rows,
+        "rows_per_second": rows / sum(timings),
+        **_percentiles(timings),
+        "peak_bytes": _peak_bytes(memory_call),
+    }
+
+
+def _path_operations(path: str, engine):
+    """Returns (insert_many, insert_one, select_by_name, scan, join) functions for text(), Core or ORM."""
+    from sqlalchemy import bindparam, insert, select, text
+    from sqlalchemy.orm import Session
+    from core_metadata import user_table, address_table
+    from orm_metadata import User, Address
+
+    if path == "text":
+        insert_stmt = text("INSERT INTO user_account (id, name, fullname) VALUES (:id, :name, :fullname)")
+        name_stmt = text("SELECT id, name, fullname FROM user_account WHERE name = :name")
+        scan_stmt = text("SELECT id, name, fullname FROM user_account")
+        join_stmt = text(
+            "SELECT user_account.id, user_account.name, address.email_address "
+            "FROM user_account JOIN address ON address.user_id = user_account.id"
+        )
+    elif path == "core":
+        insert_stmt = insert(user_table)
+        name_stmt = select(user_table).where(user_table.c.name == bindparam("name"))
+        scan_stmt = select(user_table)
+        join_stmt = select(user_table.c.id, user_table.c.name, address_table.c.email_address).join_from(user_table, address_table)
+
+    if path in ("text", "core"):
+        def insert_many(rows):
+            with engine.begin() as conn:
+                conn.execute(insert_stmt, rows)
+            return len(rows)
+        def insert_one(row):
+            with engine.begin() as conn:
+                conn.execute(insert_stmt, row)
+            return 1
+        def select_by_name(name):
+            with engine.connect() as conn:
+                return len(conn.execute(name_stmt, {"name": name}).all())
+        def scan():
+            with engine.connect() as conn:
+                return len(conn.execute(scan_stmt).all())
+        def join():
+            with engine.connect() as conn:
+                return len(conn.execute(join_stmt).all())
+        return insert_many, insert_one, select_by_name, scan, join
+
+    def insert_many(rows):
+        with Session(engine) as session:
+            session.add_all([User(**row) for row in rows])
+            session.commit()
+        return len(rows)
+    def insert_one(row):
+        with Session(engine) as session:
+            session.add(User(**row))
+            session.commit()
+        return 1
+    def select_by_name(name):
+        with Session(engine) as session:
+            return len(session.scalars(select(User).where(User.name == name)).all())
+    def scan():
+        with Session(engine) as session:
+            return len(session.scalars(select(User)).all())
+    def join():
+        with Session(engine) as session:
+            return len(session.execute(select(User, Address).join(User.addresses)).all())
+    return insert_many, insert_one, select_by_name, scan, join
+
+
+def _bench_path(path: str, url: str, rows: int, lookups: int, scans: int, seed: int) -> Dict[str, Dict[str, float]]:
+    import random
+    from sqlalchemy import create_engine, insert
+    from core_metadata import metadata_obj, user_table, address_table
+
+    engine = create_engine(url)
+    tables = [user_table, address_table]
+    metadata_obj.drop_all(engine, tables=tables)
+    metadata_obj.create_all(engine, tables=tables)
+    insert_many, insert_one, select_by_name, scan, join = _path_operations(path, engine)
+    chunk = 10_000
+    user = lambda i: {"id": i, "name": f"user{i}", "fullname": f"User Number {i}"}
+    try:
+        results = {}
+        results["executemany"] = _measure(
+            [lambda start=start: insert_many([user(i) for i in range(start, min(start + chunk, rows + 1))])
+             for start in range(1, rows + 1, chunk)],
+            # One more chunk, with ids after the ones single_insert uses
+            lambda: insert_many([user(i) for i in range(rows + 1001, rows + 1001 + min(chunk, rows))]),
+        )
+        singles = min(rows, 1000)
+        results["single_insert"] = _measure(
+            [lambda i=i: insert_one(user(i)) for i in range(rows + 1, rows + singles)],
+            lambda: insert_one(user(rows + singles)),
+        )
+        # Not measured: back to exactly `rows` users, and the addresses for the join
+        with engine.begin() as conn:
+            conn.execute(user_table.delete().where(user_table.c.id > rows))
+            for start in range(1, rows + 1, chunk):
+                conn.execute(insert(address_table), [
+                    {"user_id": i, "email_address": f"user{i}@example.org"} for i in range(start, min(start + chunk, rows + 1))
+                ])
+        # Seeded per table size, so every path (and every run with the same seed) looks up the same names
+        rng = random.Random(f"{seed}:{rows}")
+        names = [f"user{rng.randint(1, rows)}" for _ in range(lookups)]
+        results["point_select"] = _measure([lambda name=name: select_by_name(name) for name in names], lambda: select_by_name(names[0]))
+        results["full_scan"] = _measure([scan] * scans, scan)
+        results["join"] = _measure([join] * scans, join)
+    finally:
+        metadata_obj.drop_all(engine, tables=tables)
+        engine.dispose()
+    return results
+
+
+def bench_paths(rows: Sequence[int] = (1_000, 100_000, 1_000_000), urls: Optional[Sequence[str]] = None,
+                lookups: int = 1000, scans: int = 3, output: Optional[str] = "bench_paths.json", seed: int = 0) -> Dict[str, object]:
+    """text() vs. Core vs. ORM for every operation, per database and table size. Also written to `output`."""
+    import platform
+    import sqlalchemy
+    from sqlalchemy.engine import make_url
+
+    if urls is None:
+        urls = ["sqlite://"]
+        mysql_url = _mysql_scratch_url()
+        if mysql_url:
+            urls.append(mysql_url)
+    revision = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    results: Dict[str, object] = {
+        "sqlalchemy": sqlalchemy.__version__,
+        "python": platform.python_version(),
+        "git_revision": revision or None,
+        "lookups": lookups,
+        "scans": scans,
+        "seed": seed,
+        "databases": {},
+    }
+    for url in urls:
+        name = make_url(url).render_as_string(hide_password=True)
+        results["databases"][name] = {
+            str(n): {path: _bench_path(path, url, n, lookups, scans, seed) for path in PATHS} for n in rows
+        }
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+# text() per call vs. the prebuilt statements in statements.py
+"""
+Runs the point lookup of core.select_all_from_some_table_where_x_is() `calls` times on an in-memory SQLite
+database: once building text(...) in every call, as core.py used to, and once with the prebuilt
+statements.SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS. Also times only building the statement plus computing its
+cache key (what SQLAlchemy does to find the compiled statement), without executing anything, and reports the
+compiled cache hits and misses counted by statements.track_statement_cache().
+"""
+def bench_statements(calls: int = 100_000) -> Dict[str, object]:
+    from sqlalchemy import create_engine, text
+    import statements
+
+    sql = "SELECT * FROM some_table WHERE x = :x"
+    prebuilt = statements.SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS
+    engine = create_engine("sqlite://")
+    statements.track_statement_cache(engine)
+    statements.registry.reset_stats()
+
+    def per_call_us(fn: Callable[[int], object]) -> float:
+        start = time.perf_counter()
+        for i in range(calls):
+            fn(i)
+        return (time.perf_counter() - start) / calls * 1_000_000
+
+    results: Dict[str, object] = {"calls": calls}
+    results["cache_key_only_us"] = {
+        "text_per_call": per_call_us(lambda i: text(sql)._generate_cache_key()),
+        "prebuilt": per_call_us(lambda i: prebuilt._generate_cache_key()),
+    }
+    with engine.connect() as conn:
+        conn.execute(statements.CREATE_SOME_TABLE)
+        conn.execute(statements.INSERT_INTO_SOME_TABLE, [{"x": x, "y": x} for x in range(100)])
+        results["execute_us"] = {
+            "text_per_call": per_call_us(lambda i: conn.execute(text(sql), {"x": i % 100}).all()),
+            "prebuilt": per_call_us(lambda i: conn.execute(prebuilt, {"x": i % 100}).all()),
+        }
+    results["compiled_cache"] = statements.registry.stats()
+    engine.dispose()
+    return results
+
+
+# Server-side prepared statements vs. PyMySQL's client-side interpolation
+"""
+Runs the point lookup of core.select_all_from_some_table_where_x_is() `queries` times, once through PyMySQL
+(full SQL text every time) and once as a server-side prepared statement through prepared.execute_prepared().
+Per query it reports the latency (p50/p99), the CPU time of this process, and the CPU time (MySQL 8.0.28+) and
+total time MySQL spent on the statement, taken from performance_schema.events_statements_summary_by_digest
+before and after each run. Both runs have the same digest, so they must not overlap. Needs MySQL.
+"""
+DIGEST_PREFIX = "SELECT * FROM `some_table` WHERE `x` = ?"
+
+
+def _server_statement_totals(conn) -> Dict[str, Optional[int]]:
+    """Executions, CPU and total time (picoseconds) MySQL recorded for the some_table point lookup."""
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError, ProgrammingError
+    query = (
+        "SELECT SUM(COUNT_STAR), {cpu}, SUM(SUM_TIMER_WAIT) "
+        "FROM performance_schema.events_statements_summary_by_digest WHERE DIGEST_TEXT LIKE :digest"
+    )
+    try:
+        row = conn.execute(text(query.format(cpu="SUM(SUM_CPU_TIME)")), {"digest": DIGEST_PREFIX + "%"}).one()
+        cpu_ps = int(row[1] or 0)
+    except (OperationalError, ProgrammingError):
+        # No SUM_CPU_TIME before MySQL 8.0.28
+        row = conn.execute(text(query.format(cpu="NULL")), {"digest": DIGEST_PREFIX + "%"}).one()
+        cpu_ps = None
+    return {"count": int(row[0] or 0), "cpu_ps": cpu_ps, "wait_ps": int(row[2] or 0)}
+
+
+def bench_prepared(queries: int = 20_000) -> Dict[str, object]:
+    from keys import get_engine
+    import core
+    import prepared
+    from statements import SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS
+
+    engine = get_engine()
+    if engine.dialect.name != "mysql":
+        return {"skipped": f"needs MySQL, not {engine.dialect.name}"}
+    core.create_some_table()
+
+    def text_protocol(i: int) -> object:
+        with engine.connect() as conn:
+            return conn.execute(SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS, {"x": i % 100}).all()
+
+    def prepared_statement(i: int) -> object:
+        return prepared.execute_prepared("select_all_from_some_table_where_x_is", {"x": i % 100})
+
+    results: Dict[str, object] = {"queries": queries}
+    with engine.connect() as stats_conn:
+        for name, run in (("text_protocol", text_protocol), ("prepared", prepared_statement)):
+            run(0) # warm up: connection, and for the prepared mode the COM_STMT_PREPARE
+            before = _server_statement_totals(stats_conn)
+            counter = iter(range(queries))
+            cpu_start = time.process_time()
+            latency = _latency(lambda: run(next(counter)), queries)
+            client_cpu = time.process_time() - cpu_start
+            after = _server_statement_totals(stats_conn)
+            executions = after["count"] - before["count"]
+            results[name] = {
+                **latency,
+                "client_cpu_us_per_query": client_cpu / queries * 1_000_000,
+                "server_executions": executions,
+                "server_cpu_us_per_query": (after["cpu_ps"] - before["cpu_ps"]) / executions / 1_000_000
+                    if executions and after["cpu_ps"] is not None else None,
+                "server_time_us_per_query": (after["wait_ps"] - before["wait_ps"]) / executions / 1_000_000
+                    if executions else None,
+            }
+    results["prepared_statements"] = prepared.stats()
+    return results
+
+
+# Group commit: WriteCoalescer batch sizes
+"""
+`writers` threads insert `rows` users between them through one coalescer.WriteCoalescer, each thread submitting
+one row and waiting for its Future before it submits the next, like request handlers do. That is run once per
+max_batch_size; with a max_batch_size of 1 every row is its own transaction, like insert_into_user_table().
+
+Reports rows/sec, the p50/p99 latency of one insert (submit until the Future resolves) and the average batch size.
+Runs on a scratch database (`url`, by default a SQLite file in a temporary directory, since an in-memory
+database is private to one connection), so commits really go to disk.
+"""
+def bench_coalescer(rows: int = 20_000, writers: int = 50, batch_sizes: Sequence[int] = (1, 10, 100, 500),
+                    max_delay: float = 0.005, url: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import create_engine, delete
+    from coalescer import WriteCoalescer
+    from core_metadata import metadata_obj, user_table
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        engine = create_engine(url or f"sqlite:///{os.path.join(scratch_dir, 'bench_coalescer.db')}")
+        metadata_obj.create_all(engine, tables=[user_table])
+        for batch_size in batch_sizes:
+            with engine.begin() as conn:
+                conn.execute(delete(user_table))
+            coalescer = WriteCoalescer(max_batch_size=batch_size, max_delay=max_delay, engine=engine)
+            per_writer = rows // writers
+            def write(writer: int) -> List[float]:
+                timings = []
+                for i in range(per_writer):
+                    start = time.perf_counter()
+                    coalescer.submit(user_table, {"name": f"user{writer}.{i}", "fullname": "Bench User"}).result()
+                    timings.append((time.perf_counter() - start))
+                return timings
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=writers) as executor:
+                timings = [t for writer_timings in executor.map(write, range(writers)) for t in writer_timings]
+            seconds = time.perf_counter() - start
+            coalescer.close()
+            results[f"max_batch_size={batch_size}"] = {
+                "rows_per_second": len(timings) / seconds,
+                **_percentiles(timings),
+                "average_batch_size": coalescer.rows / max(coalescer.batches, 1),
+            }
+        engine.dispose()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for the sqlalchemy-demo modules")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_time = commands.add_parser("import-time", help="cold import cost of the modules")
+    import_time.add_argument("--ref", help="git revision to compare with")
+    import_time.add_argument("--repeat", type=int, default=5)
+
+    lookup_index = commands.add_parser("lookup-index", help="name lookup latency with and without an index")
+    lookup_index.add_argument("--rows", type=int, default=1_000_000)
+    lookup_index.add_argument("--lookups", type=int, default=50)
+
+    async_vs_threads = commands.add_parser("async-vs-threads", help="concurrent lookups, asyncio vs thread pool")
+    async_vs_threads.add_argument("--requests", type=int, default=5000)
+    async_vs_threads.add_argument("--concurrency", type=int, default=100)
+
+    loader_strategies = commands.add_parser("loader-strategies", help="N+1: query count per loader strategy")
+    loader_strategies.add_argument("--users", type=int, default=10_000)
+    loader_strategies.add_argument("--addresses-per-user", type=int, default=5)
+    loader_strategies.add_argument("--url", default="sqlite://", help="scratch database")
+
+    projections = commands.add_parser("projections", help="ORM objects vs read-only NamedTuple projections")
+    projections.add_argument("--users", type=int, default=100_000)
+    projections.add_argument("--url", default="sqlite://", help="scratch database")
+
+    paths = commands.add_parser("paths", help="text() vs Core vs ORM for inserts, lookups, scans and joins")
+    paths.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    paths.add_argument("--url", action="append", dest="urls", help="database to run on (repeatable), "
+                       "default: in-memory SQLite plus the local MySQL server when it is reachable")
+    paths.add_argument("--lookups", type=int, default=1000)
+    paths.add_argument("--scans", type=int, default=3)
+    paths.add_argument("--seed", type=int, default=0, help="seed for the point-select keys")
+    paths.add_argument("--output", default="bench_paths.json", help="JSON file for the results")
+
+    statements_bench = commands.add_parser("statements", help="text() built per call vs prebuilt statements")
+    statements_bench.add_argument("--calls", type=int, default=100_000)
+
+    prepared_bench = commands.add_parser("prepared", help="server-side prepared statements vs PyMySQL (MySQL only)")
+    prepared_bench.add_argument("--queries", type=int, default=20_000)
+
+    coalescer_bench = commands.add_parser("coalescer", help="WriteCoalescer rows/s and latency per max_batch_size")
+    coalescer_bench.add_argument("--rows", type=int, default=20_000)
+    coalescer_bench.add_argument("--writers", type=int, default=50)
+    coalescer_bench.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 500])
+    coalescer_bench.add_argument("--max-delay", type=float, default=0.005)
+    coalescer_bench.add_argument("--url", help="scratch database, default: a temporary SQLite file")
+
+    args = parser.parse_args()
+    if args.command == "import-time":
+        _print_json(bench_import_time(ref=args.ref, repeat=args.repeat))
+    elif args.command == "lookup-index":
+        _print_json(bench_lookup_index(rows=args.rows, lookups=args.lookups))
+    elif args.command == "async-vs-threads":
+        _print_json(bench_async_vs_threads(requests=args.requests, concurrency=args.concurrency))
+    elif args.command == "loader-strategies":
+        _print_json(bench_loader_strategies(users=args.users, addresses_per_user=args.addresses_per_user, url=args.url))
+    elif args.command == "projections":
+        _print_json(bench_projections(users=args.users, url=args.url))
+    elif args.command == "paths":
+        _print_json(bench_paths(rows=args.rows, urls=args.urls, lookups=args.lookups, scans=args.scans, output=args.output, seed=args.seed))
+    elif args.command == "statements":
+        _print_json(bench_statements(calls=args.calls))
+    elif args.command == "prepared":
+        _print_json(bench_prepared(queries=args.queries))
+    elif args.command == "coalescer":
+        _print_json(bench_coalescer(rows=args.rows, writers=args.writers, batch_sizes=args.batch_sizes,
+                                    max_delay=args.max_delay, url=args.url))
+
+
+if __name__ == "__main__":
+    main()
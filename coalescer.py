@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, FrozenSet, List, Tuple
+from keys import get_engine
+import query_cache
+from sqlalchemy import Table, insert
+
+# Group commit for single-row inserts
+"""
+insert_into_user_table() and the insert_into_some_table_* examples in core.py each check out a connection,
+run one INSERT and commit it. At high request rates that is one round trip and one fsync (the commit) per row.
+
+The WriteCoalescer collects rows from many callers and writes them together: a background thread takes
+whatever is pending, up to `max_batch_size` rows, waits at most `max_delay` seconds for more, and then
+inserts them with one executemany per table and set of columns, all in one transaction with one commit.
+Each caller gets a Future that is resolved when its row is committed, so a caller waits at most about
+`max_delay` plus the time of one batch.
+
+If the batch fails (one row violates a constraint, or lacks a required column), it is rolled back and its rows
+are retried one by one, each in its own transaction. So only the futures of the bad rows get the exception.
+
+### Example:
+`coalescer = WriteCoalescer(max_batch_size=500, max_delay=0.005)`<br>
+`future = coalescer.submit(user_table, {"name": "ed", "fullname": "Ed Jones"})`<br>
+`future.result()  # blocks until the row is committed`<br>
+`coalescer.close()`
+"""
+
+_STOP = object()
+
+
+class WriteCoalescer:
+    def __init__(self, max_batch_size: int = 500, max_delay: float = 0.005, engine=None):
+        if max_batch_size < 1 or max_delay < 0:
+            raise ValueError("max_batch_size must be at least 1 and max_delay can't be negative")
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.engine = engine or get_engine()
+        self.batches = 0
+        self.retried_batches = 0
+        self.rows = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="write-coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, table: Table, row: Dict[str, object]) -> Future:
+        """Queues `row` for insertion into `table`. The returned Future resolves to None once it is committed."""
+        future: Future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("WriteCoalescer is closed")
+            self._queue.put((table, row, future))
+        return future
+
+    def close(self) -> None:
+        """Writes everything that was submitted so far and stops the background thread."""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self) -> "WriteCoalescer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[Table, Dict[str, object], Future]]) -> None:
+        # Rows with other columns need another INSERT statement, so they are grouped by table and column names
+        groups: Dict[Tuple[Table, FrozenSet[str]], List[Tuple[Dict[str, object], Future]]] = {}
+        for table, row, future in batch:
+            if future.set_running_or_notify_cancel():
+                groups.setdefault((table, frozenset(row)), []).append((row, future))
+        if not groups:
+            return
+        try:
+            with self.engine.begin() as conn:
+                for (table, _), items in groups.items():
+                    conn.execute(insert(table), [row for row, _ in items])
+        except Exception:
+            self._retry_one_by_one(groups)
+            return
+        query_cache.invalidate(*{table.name for table, _ in groups})
+        self.batches += 1
+        for items in groups.values():
+            self.rows += len(items)
+            for _, future in items:
+                future.set_result(None)
+
+    def _retry_one_by_one(self, groups: Dict[Tuple[Table, FrozenSet[str]], List[Tuple[Dict[str, object], Future]]]) -> None:
+        self.retried_batches += 1
+        for (table, _), items in groups.items():
+            for row, future in items:
+                try:
+                    with self.engine.begin() as conn:
+                        conn.execute(insert(table), row)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                query_cache.invalidate(table.name)
+                self.rows += 1
+                future.set_result(None)
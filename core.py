@@ -1,8 +1,22 @@
-from keys import engine
+import itertools
+import os
+import tempfile
+import time
+from keys import get_engine
+import query_cache
+import prepared
 from core_metadata import user_table, address_table
+from pagination import encode_cursor, decode_cursor
+from statements import (
+    CREATE_SOME_TABLE, INSERT_INTO_SOME_TABLE, SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS, DELETE_FROM_USER_ACCOUNT_WHERE_ID_IS,
+    SELECT_ALL_FROM_USER_TABLE_WHERE_NAME_IS,
+)
 from sqlalchemy import text
 from sqlalchemy import insert, select, bindparam
-from typing import List, Dict
+from sqlalchemy import table as table_clause, column, literal_column
+from sqlalchemy import Table
+from sqlalchemy.engine import Row
+from typing import List, Dict, Iterable, Iterator, Optional, Sequence, Tuple
 
 # About the Enging and Connection:
 """
@@ -23,6 +37,8 @@ famously known as how to avoid SQL injection attacks when the data is untrusted.
 the SQLAlchemy dialects and/or DBAPI to correctly handle the incoming input for the backend. Outside of 
 plain textual SQL use cases, SQLAlchemy’s Core Expression API otherwise ensures that Python literal values 
 are passed as bound parameters where appropriate.
+
+* Note: the text() statements used below are built once, in statements.py, in stead of on every call.
 """
 
 def create_some_table():
@@ -32,19 +48,20 @@ def create_some_table():
     making a metadata object of the 'some_table' table, which is then usable in exactly 
     the same way as a Table that we declare explicitly
     """
-    with engine.connect() as conn:
-        conn.execute(text("CREATE TABLE IF NOT EXISTS some_table (x int, y int)"))
+    with get_engine().connect() as conn:
+        conn.execute(CREATE_SOME_TABLE)
         conn.commit()
 
 # "commit as you go"
 def insert_into_some_table_commit_as_you_go(x:int, y:int):
     """Please see: insert_into_some_table_begin_once()
     The code below is only committed to the database after conn.commit() is called!"""
-    with engine.connect() as conn:
-        conn.execute(text("INSERT INTO some_table (x, y) VALUES (:x, :y)"),
+    with get_engine().connect() as conn:
+        conn.execute(INSERT_INTO_SOME_TABLE,
                      {"x": x, "y": y}, # This is a parameterized query, its purpose is to prevent SQL injection
                      )
         conn.commit()
+    query_cache.invalidate("some_table")
 
 # "begin once"
 def insert_into_some_table_begin_once(x:int, y:int):
@@ -53,11 +70,12 @@ def insert_into_some_table_begin_once(x:int, y:int):
     - it shows up front that the operation is a transaction.
     - no need to call conn.commit()
     """
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         conn.execute(
-            text("INSERT INTO some_table (x, y) VALUES (:x, :y)"),
+            INSERT_INTO_SOME_TABLE,
             {"x": x, "y": y}
         )
+    query_cache.invalidate("some_table")
 
 def select_all_from_table(table:str) -> list:
     """
@@ -83,16 +101,57 @@ def select_all_from_table(table:str) -> list:
     <i>For immutable results, use the result.mappings()</i>
     """
 
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         result = conn.execute(text(f"SELECT * FROM {table}"))
         return result.all()
 
-def select_all_from_some_table_where_x_is(parameter:int) -> list:
-    """Using the `some_table` table. Demonstrating parameterized queries"""
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM some_table WHERE x = :x"), 
-                              {"x": parameter})
-        return result.all()
+def stream_all_from_table(table:str, batch_size:int=1000, columns:Optional[Sequence[str]]=None) -> Iterator[Row]:
+    """
+    Streaming variant of select_all_from_table(): a generator that yields one Row at a time.<br>
+
+    `stream_results=True` makes PyMySQL use a server-side cursor (SSCursor), so rows are read from the
+    socket as we go in stead of being buffered by the driver, and `yield_per` fetches them `batch_size`
+    at a time. Memory therefore stays the same whether the table has a thousand or ten million rows.<br>
+    Pass `columns` to only select those columns in stead of `SELECT *`.
+
+    If the consumer stops early (break, or the generator is closed / garbage collected), the unread
+    rows are still pending on the server-side cursor. Draining them could take minutes, so the
+    connection is invalidated in stead (it is closed and replaced in the pool).
+    ### Example:
+    `for row in stream_all_from_table("user_account", batch_size=5000, columns=["id", "name"]):`
+    """
+    if columns:
+        stmt = select(*[column(c) for c in columns]).select_from(table_clause(table))
+    else:
+        stmt = select(literal_column("*")).select_from(table_clause(table))
+
+    return _stream(stmt, batch_size)
+
+def _stream(stmt, batch_size:int, consistent_snapshot:bool=False) -> Iterator[Row]:
+    """Runs `stmt` on a server-side cursor, see stream_all_from_table()."""
+    with get_engine("batch").connect() as conn:
+        if consistent_snapshot and conn.dialect.name == "mysql":
+            conn.exec_driver_sql("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+        conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+        exhausted = False
+        try:
+            yield from conn.execute(stmt)
+            exhausted = True
+        finally:
+            if not exhausted:
+                conn.invalidate()
+
+def select_all_from_some_table_where_x_is(parameter:int) -> Tuple[Row, ...]:
+    """Using the `some_table` table. Demonstrating parameterized queries<br>
+    Served from the result cache when it is enabled, see query_cache.py, and run as a server-side
+    prepared statement when that is enabled, see prepared.py."""
+    def load():
+        if prepared.prepared_statements_enabled():
+            return tuple(prepared.execute_prepared("select_all_from_some_table_where_x_is", {"x": parameter}))
+        with get_engine().connect() as conn:
+            result = conn.execute(SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS, {"x": parameter})
+            return tuple(result.all())
+    return query_cache.cached(("some_table",), ("select_all_from_some_table_where_x_is", parameter), load)
 
 def execute_many_inserts_using_a_list_of_dictionaries():
     """Inserting many rows at once using a list of dictionaries<br>
@@ -101,14 +160,17 @@ def execute_many_inserts_using_a_list_of_dictionaries():
     for better performance across many rows.<br>
 
     A key behavioral difference between “execute” and “executemany” is that 
-    the latter doesn’t support returning of result rows (with some exaceptions).
+    the latter doesn’t support returning of result rows (with some exaceptions).<br>
+    For large loads, see bulk_insert_into_table().
     """
     data = [{"x": 95, "y": 45}, {"x": 74, "y": 34}]
-    with engine.connect() as conn:
-        conn.execute(text("INSERT INTO some_table (x, y) VALUES (:x, :y)"), data)
+    with get_engine().connect() as conn:
+        conn.execute(INSERT_INTO_SOME_TABLE, data)
         conn.commit()
+    query_cache.invalidate("some_table")
 
-def show_all_tables_in_database(engine=engine):
+def show_all_tables_in_database(engine=None):
+    engine = engine or get_engine()
     with engine.connect() as conn:
         # Print all MySQL tables in the database:
         result = conn.execute(text("SHOW TABLES"))
@@ -122,21 +184,24 @@ def insert_into_user_table(name:str, fullname:str):
     stmt = insert(user_table).values(name=name, fullname=fullname)
     # print(stmt)
 
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         conn.execute(stmt)
         conn.commit()
+    query_cache.invalidate("user_account")
 
 def insert_many_into_user_table(data:List[Dict[str, str]]):
     """
     This uses the metadata object `user_table` from core_metadata.py as opoosed to raw SQL.<br> 
+    For very large lists, use bulk_insert_into_table() in stead.<br>
     See: https://docs.sqlalchemy.org/en/20/tutorial/data_insert.html"""
     stmt = insert(user_table)
     # print(stmt)
 
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         # statement, parameters
         conn.execute(stmt, data) # see list_of_dicts_containing_users below
         conn.commit()
+    query_cache.invalidate("user_account")
 
 """
 The execution above features “executemany” form first illustrated at Sending Multiple Parameters (link below), however unlike 
@@ -147,6 +212,129 @@ names which are passed will be expressed in the VALUES clause of the Insert cons
 https://docs.sqlalchemy.org/en/20/tutorial/dbapi_transactions.html#tutorial-multiple-parameters
 """
 
+def bulk_insert_into_table(table:Table, rows:Iterable[Dict[str, object]], rows_per_statement:int=500, rows_per_commit:int=10_000) -> Dict[str, float]:
+    """
+    Streaming, chunked alternative to insert_many_into_user_table() for large loads into
+    `user_table` or `some_table` (see core_metadata.get_some_table()).<br>
+
+    `rows` can be any iterable (a generator reading a file, for example) and is never held in memory as a whole.
+    * rows_per_statement: rows sent in one executemany call. PyMySQL rewrites an executemany INSERT into
+      multi-row `INSERT ... VALUES (...), (...), ...` statements (splitting them at ~1MB, below the
+      server's max_allowed_packet), which is much cheaper on the Python side than compiling
+      `insert(table).values(chunk)` for every chunk.
+    * rows_per_commit: rows inserted per transaction, so locks are released and the undo log stays small
+      during long loads. If a load fails half way, the transactions committed before stay committed.
+
+    Returns the number of rows, the elapsed seconds and rows per second.
+    ### Example:
+    `bulk_insert_into_table(user_table, ({"name": f"user{i}", "fullname": "..."} for i in range(10**6)))`
+    """
+    if rows_per_statement < 1 or rows_per_commit < 1:
+        raise ValueError("rows_per_statement and rows_per_commit must be at least 1")
+    stmt = insert(table)
+    rows = iter(rows)
+    inserted = 0
+    since_commit = 0
+    start = time.perf_counter()
+
+    with get_engine("batch").connect() as conn:
+        while True:
+            chunk = list(itertools.islice(rows, rows_per_statement))
+            if not chunk:
+                break
+            conn.execute(stmt, chunk)
+            inserted += len(chunk)
+            since_commit += len(chunk)
+            if since_commit >= rows_per_commit:
+                conn.commit()
+                query_cache.invalidate(table.name)
+                since_commit = 0
+        conn.commit()
+    query_cache.invalidate(table.name)
+
+    seconds = time.perf_counter() - start
+    return {"rows": inserted, "seconds": seconds, "rows_per_second": inserted / seconds if seconds else 0.0}
+
+# LOAD DATA LOCAL INFILE
+"""
+Even batched INSERTs have to be parsed and executed statement by statement. MySQL's LOAD DATA reads a
+whole file in one go and is typically an order of magnitude faster for bulk ingest. With LOCAL the
+file is on the client: the driver sends it over the connection. Both the server (local_infile=ON) and
+the client (PyMySQL's local_infile=True, set for the "batch" profile in keys.py) must allow it.
+"""
+
+def _tsv_field(value) -> str:
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def _local_infile_enabled(conn) -> bool:
+    if conn.dialect.name != "mysql":
+        return False
+    return bool(conn.execute(text("SELECT @@GLOBAL.local_infile")).scalar())
+
+def load_data_into_table(table:Table, rows:Iterable[Dict[str, object]]) -> int:
+    """
+    Bulk ingest into `user_table` or `some_table` with LOAD DATA LOCAL INFILE.<br>
+    The rows are written to a temporary tab separated file (never held in memory as a whole),
+    which is then loaded in one statement. Returns the number of loaded rows.
+
+    On other backends than MySQL, or when the server has local_infile disabled, it falls back to
+    bulk_insert_into_table(), i.e. chunked executemany.
+
+    * Bad rows: with LOCAL, MySQL handles duplicate keys and values that don't fit as if IGNORE was given:
+      it skips or truncates those rows and only reports warnings. So in stead the number of loaded rows is
+      compared with the rows written to the file, and any warning counts as an error: the whole load is rolled
+      back and a ValueError with the first warnings (SHOW WARNINGS) is raised. Nothing is loaded then.
+    * The fallback raises SQLAlchemy's IntegrityError (or DataError) at the first bad row. Chunks that were
+      already committed stay committed, see bulk_insert_into_table().
+    ### Example:
+    `load_data_into_table(user_table, ({"name": f"user{i}", "fullname": "..."} for i in range(10**6)))`
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    rows = itertools.chain([first], rows)
+
+    engine = get_engine("batch")
+    with engine.connect() as conn:
+        use_load_data = _local_infile_enabled(conn)
+    if not use_load_data:
+        return int(bulk_insert_into_table(table, rows)["rows"])
+
+    columns = list(first.keys())
+    written = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{table.name}.tsv")
+        with open(path, "w", encoding="utf-8", newline="\n") as tsv:
+            for row in rows:
+                tsv.write("\t".join(_tsv_field(row[c]) for c in columns))
+                tsv.write("\n")
+                written += 1
+
+        with engine.connect() as conn:
+            preparer = conn.dialect.identifier_preparer
+            stmt = text(
+                f"LOAD DATA LOCAL INFILE :path INTO TABLE {preparer.format_table(table)} "
+                "CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                f"({', '.join(preparer.quote(c) for c in columns)})"
+            )
+            loaded = conn.execute(stmt, {"path": path}).rowcount
+            warnings = conn.execute(text("SHOW WARNINGS LIMIT 10")).all()
+            if loaded != written or warnings:
+                conn.rollback()
+                details = "; ".join(f"{level} {code}: {message}" for level, code, message in warnings)
+                raise ValueError(
+                    f"LOAD DATA into {table.name} loaded {loaded} of {written} rows with warnings, "
+                    f"rolled back. {details}"
+                )
+            conn.commit()
+    query_cache.invalidate(table.name)
+    return loaded
+
 list_of_dicts_containing_users = [
     {"name": "ed", "fullname": "Ed Jones"},
     {"name": "wendy", "fullname": "Wendy Williams"},
@@ -164,6 +352,8 @@ def insert_into_address_table():
     multiple users with the same username, the subquery will return multiple rows, causing an error.
     I have no constraint on the username column in the user_table, so this is possible. Adding the
     .limit(1) method to the subquery will make sure that only one row is returned for each username.
+
+    * Note: the subquery runs once for every address. For real loads use bulk_insert_into_address_table().
     """
 
     scalar_subq = (
@@ -173,7 +363,7 @@ def insert_into_address_table():
         .scalar_subquery()
     )
 
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         result = conn.execute(
             insert(address_table).values(user_id=scalar_subq),
             [
@@ -186,23 +376,113 @@ def insert_into_address_table():
             ],
         )
         conn.commit()
+    query_cache.invalidate("address")
+
+# How many user names go into one IN (...) list when resolving them to ids
+USERNAME_LOOKUP_CHUNK_SIZE = 1000
+
+def resolve_usernames_to_ids(conn, usernames:Iterable[str], on_duplicate:str="first") -> Dict[str, int]:
+    """
+    Looks up the id of every distinct user name with `WHERE name IN (...)`, one query per
+    USERNAME_LOOKUP_CHUNK_SIZE names. Names that don't exist are left out of the returned dict.<br>
+    The name column is not unique, so `on_duplicate` decides what happens when it matches several users:
+    * "first": use the lowest id
+    * "raise": raise a ValueError
+    """
+    if on_duplicate not in ("first", "raise"):
+        raise ValueError(f"on_duplicate must be 'first' or 'raise', not {on_duplicate!r}")
+    names = sorted(set(usernames))
+    ids: Dict[str, int] = {}
+    duplicates = set()
+    for i in range(0, len(names), USERNAME_LOOKUP_CHUNK_SIZE):
+        stmt = (
+            select(user_table.c.name, user_table.c.id)
+            .where(user_table.c.name.in_(names[i:i + USERNAME_LOOKUP_CHUNK_SIZE]))
+            .order_by(user_table.c.id)
+        )
+        for name, user_id in conn.execute(stmt):
+            if name in ids:
+                duplicates.add(name)
+            else:
+                ids[name] = user_id
+    if duplicates and on_duplicate == "raise":
+        raise ValueError(f"User names matching more than one user: {sorted(duplicates)}")
+    return ids
+
+def bulk_insert_into_address_table(addresses:Iterable[Dict[str, str]], on_unknown:str="skip", on_duplicate:str="first") -> int:
+    """
+    Set-based replacement for insert_into_address_table(), for loading many addresses at once.<br>
+    `addresses` are dictionaries with "username" and "email_address", like in insert_into_address_table().
+
+    In stead of a correlated subquery per address (a full scan of user_account each, as name has no index),
+    the distinct user names are resolved to ids up front (see resolve_usernames_to_ids()), and all
+    addresses are then inserted with a single executemany in one transaction.
+
+    * on_unknown="skip": addresses of user names that don't exist are left out
+    * on_unknown="raise": raise a ValueError listing the unknown user names, nothing is inserted
+    * on_duplicate: see resolve_usernames_to_ids()
+
+    Returns the number of inserted addresses.
+    """
+    if on_unknown not in ("skip", "raise"):
+        raise ValueError(f"on_unknown must be 'skip' or 'raise', not {on_unknown!r}")
+    addresses = list(addresses)
+
+    with get_engine().begin() as conn:
+        ids = resolve_usernames_to_ids(conn, (a["username"] for a in addresses), on_duplicate)
+        unknown = sorted({a["username"] for a in addresses} - ids.keys())
+        if unknown and on_unknown == "raise":
+            raise ValueError(f"Unknown user names: {unknown}")
+
+        rows = [
+            {"user_id": ids[a["username"]], "email_address": a["email_address"]}
+            for a in addresses if a["username"] in ids
+        ]
+        if rows:
+            conn.execute(insert(address_table), rows)
+    query_cache.invalidate("address")
+    return len(rows)
 
 
 def delete_data_from_user_account_table_where_user_id_is(user_id:int):
-    with engine.connect() as conn:
-        conn.execute(text("DELETE FROM user_account WHERE id = :user_id"), {"user_id": user_id})
+    with get_engine().connect() as conn:
+        conn.execute(DELETE_FROM_USER_ACCOUNT_WHERE_ID_IS, {"user_id": user_id})
         conn.commit()
+    query_cache.invalidate("user_account")
 
 
 
-def show_users_and_addresses_in_database():
-    users_res = select_all_from_table("user_account")
-    for row in users_res:
-        print(f'user_account: {row}')
+def stream_users_with_addresses(batch_size:int=1000) -> Iterator[Tuple[Tuple, List[Tuple]]]:
+    """
+    Streams `user_account LEFT JOIN address` grouped by user. Yields `((id, name, fullname), addresses)`,
+    where `addresses` is a list of `(address_id, email_address)`, empty for users without addresses.<br>
+
+    It is a single statement on a server-side cursor (see stream_all_from_table()), ordered by user id, so the
+    first users come out right away and only one user's addresses are held in memory at a time. On MySQL it
+    runs in a `START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY` transaction, so users and addresses are
+    read from the same point in time.
+    """
+    stmt = (
+        select(user_table.c.id, user_table.c.name, user_table.c.fullname,
+               address_table.c.id.label("address_id"), address_table.c.email_address)
+        .join_from(user_table, address_table, isouter=True)
+        .order_by(user_table.c.id, address_table.c.id)
+    )
+    rows = _stream(stmt, batch_size, consistent_snapshot=True)
+    try:
+        for _, group in itertools.groupby(rows, key=lambda row: row.id):
+            group = list(group)
+            user = (group[0].id, group[0].name, group[0].fullname)
+            yield user, [(row.address_id, row.email_address) for row in group if row.address_id is not None]
+    finally:
+        rows.close() # releases the connection right away if the consumer stops early
 
-    adress_res = select_all_from_table("address")
-    for row in adress_res:
-        print(f'address: {row}')
+def show_users_and_addresses_in_database():
+    """Prints every user followed by its addresses, see stream_users_with_addresses()."""
+    for user, addresses in stream_users_with_addresses():
+        print(f'user_account: {user}')
+        for address in addresses:
+            print(f'    address: {address}')
 
 # show_all_tables_in_database()
 # show_users_and_addresses_in_database()
@@ -224,10 +504,15 @@ Row objects have only one element, which contain instances of the User class, as
 Row objects contain the actual data from the database.
 """
 def select_all_from_user_table_where_name_is(name:str):
-    stmt = select(user_table).where(user_table.c.name == name)
-    with engine.connect() as conn:
-        for row in conn.execute(stmt):
-            print(row)
+    """Served from the result cache when it is enabled, see query_cache.py, and run as a server-side
+    prepared statement when that is enabled, see prepared.py."""
+    def load():
+        if prepared.prepared_statements_enabled():
+            return tuple(prepared.execute_prepared("select_all_from_user_table_where_name_is", {"name": name}))
+        with get_engine().connect() as conn:
+            return tuple(conn.execute(SELECT_ALL_FROM_USER_TABLE_WHERE_NAME_IS, {"name": name}).all())
+    for row in query_cache.cached(("user_account",), ("select_all_from_user_table_where_name_is", name), load):
+        print(row)
 
 def select_spesified_columns_from_user_table_where_name_is(name:str):
     """
@@ -239,8 +524,29 @@ def select_spesified_columns_from_user_table_where_name_is(name:str):
     `select(user_table.c.name, user_table.c.fullname)`<br>
     """
     stmt = select(user_table.c["name", "fullname"]).where(user_table.c.name == name)
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         for row in conn.execute(stmt, {"name": name}):
             print(row)
 
-select_spesified_columns_from_user_table_where_name_is("spongebob")
\ No newline at end of file
+def select_page_from_table(table:Table=user_table, cursor:Optional[str]=None, page_size:int=100) -> Tuple[List[Row], Optional[str]]:
+    """
+    Keyset pagination over `user_table` or `address_table` (see pagination.py).<br>
+    Returns the rows of the page and the cursor for the next page, which is None on the last page.
+    ### Example:
+    `rows, cursor = select_page_from_table(address_table)`<br>
+    `rows, cursor = select_page_from_table(address_table, cursor)`
+    """
+    if page_size < 1:
+        raise ValueError(f"page_size must be at least 1, not {page_size}")
+    (id_column,) = table.primary_key.columns
+    stmt = select(table).order_by(id_column).limit(page_size + 1) # one extra row tells us if there is a next page
+    last_id = decode_cursor(table.name, cursor)
+    if last_id is not None:
+        stmt = stmt.where(id_column > last_id)
+
+    with get_engine().connect() as conn:
+        rows = conn.execute(stmt).all()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(table.name, rows[-1].id)
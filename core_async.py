@@ -0,0 +1,100 @@
+from keys import get_async_engine
+import query_cache
+from core_metadata import user_table, address_table
+from statements import (
+    CREATE_SOME_TABLE, INSERT_INTO_SOME_TABLE, SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS, DELETE_FROM_USER_ACCOUNT_WHERE_ID_IS,
+)
+from sqlalchemy import text
+from sqlalchemy import insert, select, bindparam
+from sqlalchemy.engine import Row
+from typing import List, Dict
+
+# About AsyncEngine and AsyncConnection:
+"""
+This module mirrors core.py on SQLAlchemy's asyncio extension. create_async_engine() (see keys.get_async_engine())
+gives an AsyncEngine, and `async with engine.connect() as conn` an AsyncConnection, which is used exactly like the
+Connection in core.py, except that execute() and commit() are awaited.
+
+While one query waits for MySQL, the event loop runs other coroutines, so a single thread can have as many
+queries in flight as the "async" pool has connections. With the blocking functions in core.py every in-flight
+query needs its own thread (run_in_executor).
+
+The driver is aiomysql (`mysql+aiomysql://...`), see ASYNC_DRIVERS in keys.py.
+
+### Example:
+`rows = await select_all_from_some_table_where_x_is(1)`<br>
+`rows = await asyncio.gather(*(select_all_from_user_table_where_name_is(n) for n in names))`
+
+The select functions return the rows in stead of printing them, because that is what a service needs.
+"""
+
+
+async def create_some_table():
+    async with get_async_engine().connect() as conn:
+        await conn.execute(CREATE_SOME_TABLE)
+        await conn.commit()
+
+async def insert_into_some_table_commit_as_you_go(x:int, y:int):
+    async with get_async_engine().connect() as conn:
+        await conn.execute(INSERT_INTO_SOME_TABLE, {"x": x, "y": y})
+        await conn.commit()
+    query_cache.invalidate("some_table")
+
+async def insert_into_some_table_begin_once(x:int, y:int):
+    async with get_async_engine().begin() as conn:
+        await conn.execute(INSERT_INTO_SOME_TABLE, {"x": x, "y": y})
+    query_cache.invalidate("some_table")
+
+async def select_all_from_table(table:str) -> List[Row]:
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(text(f"SELECT * FROM {table}"))
+        return result.all()
+
+async def select_all_from_some_table_where_x_is(parameter:int) -> List[Row]:
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS, {"x": parameter})
+        return result.all()
+
+async def execute_many_inserts_using_a_list_of_dictionaries(data:List[Dict[str, int]]):
+    async with get_async_engine().begin() as conn:
+        await conn.execute(INSERT_INTO_SOME_TABLE, data)
+    query_cache.invalidate("some_table")
+
+async def insert_into_user_table(name:str, fullname:str):
+    async with get_async_engine().begin() as conn:
+        await conn.execute(insert(user_table).values(name=name, fullname=fullname))
+    query_cache.invalidate("user_account")
+
+async def insert_many_into_user_table(data:List[Dict[str, str]]):
+    async with get_async_engine().begin() as conn:
+        await conn.execute(insert(user_table), data)
+    query_cache.invalidate("user_account")
+
+async def insert_into_address_table(addresses:List[Dict[str, str]]):
+    """`addresses` are dictionaries with "username" and "email_address", see core.insert_into_address_table()."""
+    scalar_subq = (
+        select(user_table.c.id)
+        .where((user_table.c.name == bindparam("username")))
+        .limit(1)
+        .scalar_subquery()
+    )
+    async with get_async_engine().begin() as conn:
+        await conn.execute(insert(address_table).values(user_id=scalar_subq), addresses)
+    query_cache.invalidate("address")
+
+async def delete_data_from_user_account_table_where_user_id_is(user_id:int):
+    async with get_async_engine().begin() as conn:
+        await conn.execute(DELETE_FROM_USER_ACCOUNT_WHERE_ID_IS, {"user_id": user_id})
+    query_cache.invalidate("user_account")
+
+async def select_all_from_user_table_where_name_is(name:str) -> List[Row]:
+    stmt = select(user_table).where(user_table.c.name == name)
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(stmt)
+        return result.all()
+
+async def select_spesified_columns_from_user_table_where_name_is(name:str) -> List[Row]:
+    stmt = select(user_table.c["name", "fullname"]).where(user_table.c.name == name)
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(stmt)
+        return result.all()
@@ -1,7 +1,14 @@
-from keys import engine
-from typing import List
-from sqlalchemy import MetaData
-from sqlalchemy import Table, Column, Integer, String, ForeignKey
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from keys import get_engine
+from typing import List, Optional
+import sqlalchemy
+from sqlalchemy import MetaData, text
+from sqlalchemy import Table, Column, Integer, String, ForeignKey, Index
 
 
 # Working with Database Metadata - SQL Expression Language
@@ -47,7 +54,7 @@ user_table = Table(
     "user_account",
     metadata_obj,
     Column("id", Integer, primary_key=True),
-    Column("name", String(30)),
+    Column("name", String(30), index=True),
     Column("fullname", String(255)),
 )
 
@@ -81,8 +88,8 @@ address_table = Table(
     "address",
     metadata_obj,
     Column("id", Integer, primary_key=True),
-    Column("user_id", ForeignKey("user_account.id"), nullable=False),
-    Column("email_address", String(255), nullable=False),
+    Column("user_id", ForeignKey("user_account.id"), nullable=False, index=True),
+    Column("email_address", String(255), nullable=False, index=True),
 )
 
 # Not nullable constraint
@@ -91,6 +98,15 @@ The table above also features a another kind of constraint, which in SQL is the
 indicated above using the Column.nullable parameter.
 """
 
+# Indexes
+"""
+Column(..., index=True) declares an Index named "ix_<table>_<column>". We index the columns that core.py 
+and orm.py filter or join on: user_account.name, address.user_id and address.email_address 
+(and some_table.x, see get_some_table() below). The ORM classes in orm_metadata.py declare the same indexes, 
+so both MetaData collections describe the same database. 
+For tables that already exist, see migrations.py.
+"""
+
 # Example of getting all tables and their columns from the metadata object:
 """
 >>> print(metadata_obj.tables)
@@ -118,8 +134,9 @@ We'll invoking the MetaData.create_all() method on our MetaData, sending it the
 def create_all_tables_in_database(engine):
     metadata_obj.create_all(engine)
 
-def drop_all_metadata_tables_from_db(engine=engine):
+def drop_all_metadata_tables_from_db(engine=None):
    """Any tables in the engine database that are NOT in the metadata object will not be affected"""
+   engine = engine or get_engine()
    metadata_obj.drop_all(engine)
 
 
@@ -136,10 +153,187 @@ How to generate Table objects automatically from an existing database (called "t
 * Read more: https://docs.sqlalchemy.org/en/20/core/reflection.html
 * To do it the ORM way, see https://docs.sqlalchemy.org/en/20/orm/declarative_tables.html#orm-declarative-reflected
 """
-some_table = Table("some_table", metadata_obj, autoload_with=engine)
+_reflect_lock = threading.Lock()
+
+def get_some_table(engine=None, refresh:bool=False) -> Table:
+    """
+    Returns `some_table`, loading it the first time it is asked for and returning the same Table object on every
+    later call. Importing this module therefore never talks to the database.<br>
+    The table is loaded from the reflection cache (see below) when possible, and only reflected from the database
+    when the cache has no entry for the table's current schema, or `refresh` is True.
+    """
+    if "some_table" in metadata_obj.tables and not refresh:
+        return metadata_obj.tables["some_table"]
+    with _reflect_lock:
+        if "some_table" not in metadata_obj.tables or refresh:
+            engine = engine or get_engine()
+            with engine.connect() as conn:
+                fingerprint = schema_fingerprint(conn, "some_table")
+                reflected = None if refresh else _load_reflected_table("some_table", fingerprint)
+                if reflected is None:
+                    reflected = Table("some_table", MetaData(), autoload_with=conn)
+                    _save_reflected_table(reflected, fingerprint)
+            if "some_table" in metadata_obj.tables:
+                # Tables that were already handed out keep their columns, new callers get the refreshed one
+                metadata_obj.remove(metadata_obj.tables["some_table"])
+            some_table = reflected.to_metadata(metadata_obj)
+            if not any(ix.name == "ix_some_table_x" for ix in some_table.indexes):
+                Index("ix_some_table_x", some_table.c.x)
+    return metadata_obj.tables["some_table"]
+
+
+# Reflection cache
+"""
+Reflecting `some_table` takes several queries against the database's catalog (information_schema on MySQL), on
+every process start. For short-lived workers that is often more than the work they were started for.
+
+So the columns and indexes of the reflected Table are written to a local JSON file, and the next process rebuilds
+the Table from it with a single cheap catalog query in stead of a full reflection. That query reads the table's
+current schema: the columns (name, type, nullability) and indexes from information_schema on MySQL, the
+CREATE TABLE and CREATE INDEX statements from sqlite_master on SQLite. Its result, together with the database URL
+(without password), the table name and the SQLAlchemy version, is hashed into a fingerprint that is part of the
+file name. So any ALTER TABLE, CREATE INDEX or DROP INDEX, also one made outside migrations.py, changes the
+fingerprint, misses the cache and reflects again.
+
+* On other databases there is no such query here, and the cache is not used.
+* A file is trusted for as long as the fingerprint matches. To also expire files by age, set
+  SQLALCHEMY_REFLECTION_CACHE_MAX_AGE to a number of seconds (unset by default). clear_reflection_cache()
+  deletes all files.
+* Columns are stored with their generic SQLAlchemy type (Integer, String(30), ...), which is all Core needs to
+  build and run statements. Only column and index descriptions are stored, never code (no pickle).
+* The directory is SQLALCHEMY_REFLECTION_CACHE_DIR, by default ~/.cache/sqlalchemy-demo (created for the current
+  user only). Set it to an empty string to turn the cache off.
+"""
+# Type arguments kept in the JSON file, when the generic type has them
+_TYPE_ARGUMENTS = ("length", "precision", "scale", "timezone")
+
+def _reflection_cache_dir() -> Optional[str]:
+    directory = os.getenv("SQLALCHEMY_REFLECTION_CACHE_DIR")
+    if directory is None:
+        directory = os.path.join(os.path.expanduser("~"), ".cache", "sqlalchemy-demo")
+    return directory or None
+
+def _reflection_cache_max_age() -> Optional[float]:
+    max_age = os.getenv("SQLALCHEMY_REFLECTION_CACHE_MAX_AGE")
+    return float(max_age) if max_age else None
+
+# One query per dialect that returns the current schema of table :table_name
+_SCHEMA_QUERIES = {
+    "mysql": text(
+        "SELECT 'column', COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, ORDINAL_POSITION FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+        "UNION ALL "
+        "SELECT 'index', INDEX_NAME, COLUMN_NAME, NON_UNIQUE, SEQ_IN_INDEX FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+        "ORDER BY 1, 2, 5"
+    ),
+    "sqlite": text("SELECT type, name, sql FROM sqlite_master WHERE tbl_name = :table_name ORDER BY type, name"),
+}
+
+def schema_fingerprint(conn, table_name:str) -> Optional[str]:
+    """
+    A hash of the current schema of `table_name` as the database reports it (see _SCHEMA_QUERIES), or None when
+    there is no schema query for the database.
+    """
+    query = _SCHEMA_QUERIES.get(conn.dialect.name)
+    if query is None:
+        return None
+    schema = conn.execute(query, {"table_name": table_name}).all()
+    url = conn.engine.url.render_as_string(hide_password=True)
+    parts = [url, table_name, sqlalchemy.__version__, repr([tuple(row) for row in schema])]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+def _reflection_cache_path(table_name:str, fingerprint:Optional[str]) -> Optional[str]:
+    directory = _reflection_cache_dir()
+    if directory is None or fingerprint is None:
+        return None
+    return os.path.join(directory, f"{table_name}-{fingerprint}.json")
+
+def _describe_table(table:Table) -> Optional[dict]:
+    """The columns and indexes of `table` as plain JSON data, or None if a column type has no generic form."""
+    columns = []
+    for column in table.columns:
+        try:
+            generic = column.type.as_generic()
+        except NotImplementedError:
+            return None
+        columns.append({
+            "name": column.name,
+            "type": type(generic).__name__,
+            "type_arguments": {a: getattr(generic, a) for a in _TYPE_ARGUMENTS if getattr(generic, a, None) is not None},
+            "nullable": column.nullable,
+            "primary_key": column.primary_key,
+        })
+    indexes = [
+        {"name": index.name, "columns": [c.name for c in index.columns], "unique": bool(index.unique)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name or "")
+    ]
+    return {"name": table.name, "columns": columns, "indexes": indexes}
+
+def _build_table(description:dict) -> Table:
+    table = Table(description["name"], MetaData())
+    for column in description["columns"]:
+        type_class = getattr(sqlalchemy.types, column["type"])
+        if not (isinstance(type_class, type) and issubclass(type_class, sqlalchemy.types.TypeEngine)):
+            raise ValueError(f"Not a column type: {column['type']!r}")
+        table.append_column(Column(
+            column["name"],
+            type_class(**column["type_arguments"]),
+            nullable=column["nullable"],
+            primary_key=column["primary_key"],
+        ))
+    for index in description["indexes"]:
+        Index(index["name"], *(table.c[name] for name in index["columns"]), unique=index["unique"])
+    return table
+
+def _load_reflected_table(table_name:str, fingerprint:Optional[str]) -> Optional[Table]:
+    path = _reflection_cache_path(table_name, fingerprint)
+    if path is None:
+        return None
+    try:
+        max_age = _reflection_cache_max_age()
+        if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+            return None # too old to trust, reflect again
+        with open(path, encoding="utf-8") as f:
+            return _build_table(json.load(f))
+    except Exception:
+        # Missing, unreadable or from an incompatible version: reflect again and overwrite it
+        return None
+
+def _save_reflected_table(table:Table, fingerprint:Optional[str]) -> None:
+    path = _reflection_cache_path(table.name, fingerprint)
+    description = _describe_table(table)
+    if path is None or description is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Written to a temporary file and renamed, so a concurrently starting worker never reads half a file
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path), delete=False) as f:
+            json.dump(description, f)
+        os.replace(f.name, path)
+    except OSError:
+        pass # The cache is only an optimization, a read-only home directory shouldn't break the app
+
+def clear_reflection_cache() -> int:
+    """Deletes all cached reflections. Returns the number of files deleted."""
+    directory = _reflection_cache_dir()
+    if directory is None or not os.path.isdir(directory):
+        return 0
+    deleted = 0
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            os.remove(os.path.join(directory, name))
+            deleted += 1
+    return deleted
+
+def __getattr__(name: str):
+    # Keeps `from core_metadata import some_table` working, reflecting on first access
+    if name == "some_table":
+        return get_some_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 """
-The 'some_table' object now contains the information about the Column objects present in the table, 
+The 'some_table' object (see get_some_table()) now contains the information about the Column objects present in the table, 
 and the object is usable in exactly the same way as a Table that we declared explicitly:
 
 >>> some_table
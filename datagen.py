@@ -0,0 +1,113 @@
+import argparse
+import itertools
+import random
+from typing import Dict, Iterator, List, Optional
+from keys import get_engine
+from core_metadata import metadata_obj, user_table, address_table, get_some_table
+from sqlalchemy import func, select
+
+# Synthetic data
+"""
+The only fixtures in the repo are the six users in core.list_of_dicts_containing_users and two some_table rows,
+which is not enough to measure anything. The generators below produce any number of rows, one at a time, so
+tens of millions of users never have to fit in memory:
+
+* generate_users(): users with explicit ids, a unique name (first name + id) and a full name
+* generate_addresses(): addresses of those users with a skewed fan-out: most users have no or one address, and
+  a few have hundreds (Pareto distributed, like accounts in real systems)
+* generate_some_table_rows(): x follows a Zipf distribution over `distinct_x` values (a few hot keys, a long
+  tail of rare ones), y is uniform
+
+Everything is derived from `seed`, with a separate random stream per table, so the same arguments always give
+exactly the same rows. populate() streams them into the database with core.load_data_into_table(), i.e.
+LOAD DATA LOCAL INFILE on MySQL and chunked executemany everywhere else.
+
+Run it with: `python datagen.py --users 10000000 --some-table-rows 10000000 --seed 42`
+"""
+
+FIRST_NAMES = [
+    "ed", "wendy", "mary", "fred", "sandy", "patrick", "squidward", "eugene", "sheldon", "pearl",
+    "karen", "gary", "larry", "bubble", "puff", "plankton", "spongebob", "barnacle", "flying", "mermaid",
+]
+LAST_NAMES = [
+    "Jones", "Williams", "Contrary", "Flintstone", "Cheeks", "Star", "Tentacles", "Krabs", "Squarepants", "Puff",
+]
+
+
+def _rng(seed: int, stream: str) -> random.Random:
+    return random.Random(f"{seed}:{stream}")
+
+def generate_users(count: int, seed: int = 0, start_id: int = 1) -> Iterator[Dict[str, object]]:
+    rng = _rng(seed, "users")
+    for user_id in range(start_id, start_id + count):
+        first = rng.choice(FIRST_NAMES)
+        yield {
+            "id": user_id,
+            "name": f"{first}{user_id}",
+            "fullname": f"{first.capitalize()} {rng.choice(LAST_NAMES)}",
+        }
+
+def generate_addresses(user_count: int, seed: int = 0, start_id: int = 1, alpha: float = 1.5,
+                       max_per_user: int = 1000) -> Iterator[Dict[str, object]]:
+    """
+    Addresses for the users `start_id` up to `start_id + user_count`, in user id order.<br>
+    The number of addresses of a user is Pareto(`alpha`) - 1, capped at `max_per_user`. With the default alpha of
+    1.5 that is about 1.5 addresses per user on average: two thirds of the users have none, and the top 1% of the
+    users own about a third of all addresses.
+    """
+    rng = _rng(seed, "addresses")
+    for user_id in range(start_id, start_id + user_count):
+        fan_out = min(int(rng.paretovariate(alpha)) - 1, max_per_user)
+        for n in range(fan_out):
+            yield {"user_id": user_id, "email_address": f"user{user_id}.{n}@example.org"}
+
+def generate_some_table_rows(count: int, seed: int = 0, distinct_x: int = 10_000, skew: float = 1.1,
+                             max_y: int = 1_000_000) -> Iterator[Dict[str, int]]:
+    """
+    `count` rows where x is Zipf(`skew`) distributed over 1..`distinct_x` (x=1 is the most frequent value)
+    and y is uniform over 0..`max_y`.
+    """
+    rng = _rng(seed, "some_table")
+    xs = range(1, distinct_x + 1)
+    cum_weights = list(itertools.accumulate(1 / x ** skew for x in xs))
+    remaining = count
+    while remaining > 0:
+        # random.choices draws many values per call, which is much faster than one call per row
+        chunk = rng.choices(xs, cum_weights=cum_weights, k=min(remaining, 10_000))
+        for x in chunk:
+            yield {"x": x, "y": rng.randint(0, max_y)}
+        remaining -= len(chunk)
+
+def populate(users: int = 0, some_table_rows: int = 0, seed: int = 0) -> Dict[str, int]:
+    """
+    Creates the tables if needed and loads `users` users with their addresses and `some_table_rows` some_table rows.
+    The new users get the ids after the current highest one, so populate() can be run again to grow the data.
+    Returns the number of rows loaded per table.
+    """
+    from core import create_some_table, load_data_into_table
+
+    engine = get_engine("batch")
+    metadata_obj.create_all(engine, tables=[user_table, address_table])
+    loaded = {}
+    if users:
+        with engine.connect() as conn:
+            start_id = (conn.execute(select(func.max(user_table.c.id))).scalar() or 0) + 1
+        loaded[user_table.name] = load_data_into_table(user_table, generate_users(users, seed, start_id))
+        loaded[address_table.name] = load_data_into_table(address_table, generate_addresses(users, seed, start_id))
+    if some_table_rows:
+        create_some_table()
+        loaded["some_table"] = load_data_into_table(get_some_table(engine), generate_some_table_rows(some_table_rows, seed))
+    return loaded
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load deterministic synthetic data")
+    parser.add_argument("--users", type=int, default=0, help="users to add (with their addresses)")
+    parser.add_argument("--some-table-rows", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    print(populate(users=args.users, some_table_rows=args.some_table_rows, seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import bisect
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# About query instrumentation:
+"""
+echo=True formats and logs every statement and every parameter set, which under load costs more than
+the queries themselves. In stead we hook into the Engine events before_cursor_execute and
+after_cursor_execute, and only keep numbers: how long each statement took, how many rows it touched
+and which function in core.py / orm.py issued it. The numbers go into in-memory histograms that can
+be exported as JSON or in the Prometheus text format.
+
+* Disabled mode: an Engine that was never instrumented (or was passed to uninstrument_engine()) has no
+  listeners at all, so there is nothing to pay for.
+* Sampling: with sample_rate=0.1 only every ~10th statement is timed, the rest return right away.
+
+### Example:
+`instrument_engine(get_engine(), sample_rate=0.1)`<br>
+`print(export_prometheus())`
+"""
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Functions in these modules are reported as the caller of a statement
+CALLER_MODULES = ("core", "orm")
+
+
+class Histogram:
+    """Cumulative-style latency histogram, plus the total rows affected by the timed statements."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.rows = 0
+
+    def observe(self, seconds: float, rows: int) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if rows > 0:
+            self.rows += rows
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        histogram.rows = self.rows
+        return histogram
+
+    def cumulative_counts(self) -> List[int]:
+        total, out = 0, []
+        for c in self.counts:
+            total += c
+            out.append(total)
+        return out
+
+
+class QueryStats:
+    """Histograms keyed by (calling function, SQL statement)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, caller: str, statement: str, seconds: float, rows: int) -> None:
+        key = (caller, statement)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds, rows)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[Tuple[str, str], Histogram]:
+        """Copies of the histograms, which later statements don't change."""
+        with self._lock:
+            return {key: histogram.copy() for key, histogram in self._histograms.items()}
+
+
+stats = QueryStats()
+
+_instrumented: Dict[int, float] = {}  # id(engine) -> sample rate
+
+
+def _statement_id(statement: str) -> str:
+    return hashlib.sha1(statement.encode("utf-8")).hexdigest()[:12]
+
+
+def _find_caller() -> str:
+    """Walks up the stack to the first function defined in one of the CALLER_MODULES."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__")
+        if module in CALLER_MODULES:
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sample_rate = _instrumented.get(id(conn.engine), 0.0)
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    context._query_caller = _find_caller()
+    context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    context._query_start = None
+    stats.record(context._query_caller, statement, elapsed, cursor.rowcount)
+
+
+def instrument_engine(engine: Engine, sample_rate: float = 1.0) -> None:
+    """
+    Starts timing the statements executed through `engine`.<br>
+    Calling it again only changes the sample rate.
+    """
+    if not 0.0 < sample_rate <= 1.0:
+        raise ValueError("sample_rate must be in (0, 1]")
+    already_instrumented = id(engine) in _instrumented
+    _instrumented[id(engine)] = sample_rate
+    if not already_instrumented:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def uninstrument_engine(engine: Engine) -> None:
+    """Removes the listeners again, so the engine is back to zero overhead."""
+    if _instrumented.pop(id(engine), None) is not None:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def export_json(indent: Optional[int] = None) -> str:
+    """All histograms as a JSON document, one entry per (caller, statement)."""
+    queries = []
+    for (caller, statement), h in sorted(stats.snapshot().items()):
+        queries.append({
+            "caller": caller,
+            "statement_id": _statement_id(statement),
+            "statement": statement,
+            "count": h.count,
+            "sum_seconds": h.sum,
+            "rows": h.rows,
+            "buckets": {str(le): c for le, c in zip(h.buckets, h.cumulative_counts())},
+        })
+    return json.dumps({"queries": queries}, indent=indent)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def export_prometheus() -> str:
+    """
+    All histograms in the Prometheus text exposition format.<br>
+    The statement text is too long for a label, so series are labeled with a short statement_id
+    (see export_json() for the statement belonging to an id).
+    """
+    lines = [
+        "# HELP sqlalchemy_query_duration_seconds Wall time of statements executed by the DBAPI cursor.",
+        "# TYPE sqlalchemy_query_duration_seconds histogram",
+    ]
+    rows_lines = [
+        "# HELP sqlalchemy_query_rows_total Rows affected or returned, as reported by cursor.rowcount.",
+        "# TYPE sqlalchemy_query_rows_total counter",
+    ]
+    for (caller, statement), h in sorted(stats.snapshot().items()):
+        labels = f'caller="{_label(caller)}",statement_id="{_statement_id(statement)}"'
+        cumulative = h.cumulative_counts()
+        for le, c in zip(h.buckets, cumulative):
+            lines.append(f'sqlalchemy_query_duration_seconds_bucket{{{labels},le="{le}"}} {c}')
+        lines.append(f'sqlalchemy_query_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative[-1]}')
+        lines.append(f"sqlalchemy_query_duration_seconds_sum{{{labels}}} {h.sum}")
+        lines.append(f"sqlalchemy_query_duration_seconds_count{{{labels}}} {h.count}")
+        rows_lines.append(f"sqlalchemy_query_rows_total{{{labels}}} {h.rows}")
+    return "\n".join(lines + rows_lines) + "\n"
@@ -1,23 +1,222 @@
 import os
-from dotenv import load_dotenv
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
 
-load_dotenv()  # Load environment variables from .env file
-
-#MYSQL_HOST=os.getenv("MYSQL_HOST") # Use this if you containerize your app
-MYSQL_HOST="localhost"
-
-MYSQL_USER=os.getenv("MYSQL_USER")
-MYSQL_PASSWORD=os.getenv("MYSQL_PASSWORD")
-MYSQL_DB=os.getenv("MYSQL_DB")
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
 
 # Check Docker Logs for MySQL, example:
 """
 2024-08-22 13:15:18 2024-08-22T11:15:18.285380Z 0 [System] [MY-010931] [Server] /usr/sbin/mysqld: ready for connections. Version: '8.0.39'  socket: '/var/run/mysqld/mysqld.sock'  port: 3306  MySQL Community Server - GPL.
 """
 
-# SQLite database file path
-connection_string = f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{3306}/{MYSQL_DB}'
+# Engine profiles
+"""
+Nothing in this module touches the database, the .env file or the connection pool at import time.
+The Engine is built the first time someone asks for it with get_engine(), and is then kept in a
+registry so that every caller using the same profile shares one Engine (and therefore one pool).
+
+* oltp:  many short transactions from request handlers. Bigger pool, recycled connections, pre-ping.
+* batch: few long-running connections for bulk loads and exports.
+* async: for get_async_engine(). One event loop can keep many queries in flight, so the pool is bigger.
+* test:  small pool with echo=True, handy when reading along with the tutorial.
+* prepared: like oltp, but on MySQL through mysql-connector, for the server-side prepared statements in prepared.py.
+
+The profile used when none is given can be chosen with the SQLALCHEMY_PROFILE environment variable.
+Set SQLALCHEMY_QUERY_SAMPLE_RATE (e.g. 0.1) to time statements with instrumentation.py in stead of echo.
+"""
+ENGINE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "oltp": {
+        "pool_size": 20,
+        "max_overflow": 10,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "echo": False,
+    },
+    "batch": {
+        "pool_size": 4,
+        "max_overflow": 0,
+        "pool_recycle": 3600,
+        "pool_pre_ping": True,
+        "echo": False,
+    },
+    "async": {
+        "pool_size": 50,
+        "max_overflow": 50,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "echo": False,
+    },
+    "test": {
+        "pool_size": 2,
+        "max_overflow": 0,
+        "pool_recycle": -1,
+        "pool_pre_ping": False,
+        "echo": True,
+    },
+    "prepared": {
+        "pool_size": 20,
+        "max_overflow": 10,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+        "echo": False,
+    },
+}
+
+# Extra DBAPI connect() arguments per profile, only used for MySQL (PyMySQL) connections.
+# local_infile lets core.load_data_into_table() use LOAD DATA LOCAL INFILE for bulk loads.
+MYSQL_CONNECT_ARGS: Dict[str, Dict[str, Any]] = {
+    "batch": {"local_infile": True},
+}
+
+DEFAULT_PROFILE = "oltp"
+
+# Async drivers used by get_async_engine(), per backend
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+# Profiles that need another driver than the one in the connection string, per backend.
+# PyMySQL has no server-side prepared statements, mysql-connector does (cursor(prepared=True)).
+PROFILE_DRIVERS: Dict[str, Dict[str, str]] = {
+    "prepared": {"mysql": "mysqlconnector"},
+}
+
+_engines: Dict[str, Engine] = {}
+_async_engines: Dict[str, "AsyncEngine"] = {}
+_engines_lock = threading.Lock()
+_env_loaded = False
+
+
+def _load_env() -> None:
+    """Load environment variables from the .env file, once per process."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def get_connection_string() -> str:
+    """
+    Builds the MySQL connection string from the environment.<br>
+    Set DATABASE_URL to point the demo at another database (e.g. `sqlite:///demo.db`).
+    """
+    _load_env()
+    if os.getenv("DATABASE_URL"):
+        return os.environ["DATABASE_URL"]
+
+    #MYSQL_HOST=os.getenv("MYSQL_HOST") # Use this if you containerize your app
+    MYSQL_HOST = "localhost"
+
+    MYSQL_USER = os.getenv("MYSQL_USER")
+    MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
+    MYSQL_DB = os.getenv("MYSQL_DB")
+    return f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{3306}/{MYSQL_DB}'
+
+
+def _query_sample_rate() -> float:
+    """SQLALCHEMY_QUERY_SAMPLE_RATE: the share of statements timed by instrumentation.py, 0 (the default) is off."""
+    value = os.getenv("SQLALCHEMY_QUERY_SAMPLE_RATE", "0")
+    try:
+        sample_rate = float(value)
+    except ValueError:
+        sample_rate = -1.0
+    if not 0.0 <= sample_rate <= 1.0:
+        raise ValueError(f"SQLALCHEMY_QUERY_SAMPLE_RATE must be a number from 0 to 1, not {value!r}")
+    return sample_rate
+
+
+def get_engine(profile: Optional[str] = None) -> Engine:
+    """
+    Returns the shared Engine for `profile`, creating it on first use.<br>
+    See ENGINE_PROFILES for the available profiles and their pool settings.
+    """
+    _load_env()
+    profile = profile or os.getenv("SQLALCHEMY_PROFILE", DEFAULT_PROFILE)
+    engine = _engines.get(profile)
+    if engine is not None:
+        return engine
+
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown engine profile {profile!r}, expected one of {sorted(ENGINE_PROFILES)}")
+
+    with _engines_lock:
+        engine = _engines.get(profile)
+        if engine is None:
+            # Checked before create_engine(), so a bad value doesn't leave an engine behind that nobody disposes
+            sample_rate = _query_sample_rate()
+            url = make_url(get_connection_string())
+            driver = PROFILE_DRIVERS.get(profile, {}).get(url.get_backend_name())
+            if driver:
+                url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+            engine = create_engine(url, **_engine_options(profile, url))
+            if sample_rate > 0:
+                from instrumentation import instrument_engine
+                instrument_engine(engine, sample_rate)
+            _engines[profile] = engine
+    return engine
+
+
+def get_async_engine(profile: str = "async") -> "AsyncEngine":
+    """
+    Returns the shared AsyncEngine for `profile`, creating it on first use.<br>
+    Uses the same database as get_engine(), through the async driver in ASYNC_DRIVERS (aiomysql for MySQL).
+    """
+    _load_env()
+    engine = _async_engines.get(profile)
+    if engine is not None:
+        return engine
+
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown engine profile {profile!r}, expected one of {sorted(ENGINE_PROFILES)}")
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+    with _engines_lock:
+        engine = _async_engines.get(profile)
+        if engine is None:
+            url = make_url(get_connection_string())
+            url = url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}")
+            engine = create_async_engine(url, **_engine_options(profile, url))
+            _async_engines[profile] = engine
+    return engine
+
+
+def _engine_options(profile: str, url) -> Dict[str, Any]:
+    options = dict(ENGINE_PROFILES[profile])
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        # SQLite does not use a sized QueuePool for every kind of database
+        options.pop("pool_size")
+        options.pop("max_overflow")
+    elif backend == "mysql" and profile in MYSQL_CONNECT_ARGS:
+        options["connect_args"] = MYSQL_CONNECT_ARGS[profile]
+    return options
+
+
+def dispose_engines(close: bool = True) -> None:
+    """
+    Drops all engines built so far, so the next get_engine() builds a new one with a new pool.<br>
+    * close=True: closes the pooled connections, e.g. at shutdown.
+    * close=False: in a worker process right after fork. The pooled connections are sockets shared with the
+      parent, closing them would break the parent's connections, so they are only forgotten.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+        _engines.clear()
+
+
+async def dispose_async_engines() -> None:
+    """Closes the pools of all async engines built so far. Call it before the event loop is closed."""
+    engines = list(_async_engines.values())
+    _async_engines.clear()
+    for engine in engines:
+        await engine.dispose()
 
-engine = create_engine(connection_string, echo=True)
 
+def __getattr__(name: str) -> Any:
+    # Keeps `from keys import engine` working, without building the Engine at import time
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
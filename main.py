@@ -0,0 +1,57 @@
+import argparse
+from typing import List, Optional
+
+# Entry point for the demo
+"""
+core.py, orm.py and core_metadata.py used to run queries as soon as they were imported. Those calls live
+here now, so importing the modules is free and talking to the database is something you ask for:
+
+`python main.py`                       runs the same examples the modules used to run on import
+`python main.py lookup spongebob`      Core + ORM lookup of a user name
+`python main.py two-tables`            the User/Address join from orm.py
+`python main.py tables`                SHOW TABLES
+"""
+
+
+def run_lookup(name: str) -> None:
+    import core
+    import orm
+    core.select_spesified_columns_from_user_table_where_name_is(name)
+    orm.select_users_from_User_where_name_is(name)
+
+
+def run_two_tables() -> None:
+    import orm
+    result_from_two_tables = orm.select_from_two_tables()
+    print(f'\n{len(result_from_two_tables)} rows returned:\n')
+    for row in result_from_two_tables:
+        print(row)
+
+
+def run_tables() -> None:
+    import core
+    core.show_all_tables_in_database()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="SQLAlchemy tutorial examples")
+    commands = parser.add_subparsers(dest="command")
+    lookup = commands.add_parser("lookup", help="select a user by name, Core and ORM style")
+    lookup.add_argument("name", nargs="?", default="spongebob")
+    commands.add_parser("two-tables", help="select User.name and Address from two tables")
+    commands.add_parser("tables", help="show all tables in the database")
+    args = parser.parse_args(argv)
+
+    if args.command == "lookup":
+        run_lookup(args.name)
+    elif args.command == "two-tables":
+        run_two_tables()
+    elif args.command == "tables":
+        run_tables()
+    else:
+        run_lookup("spongebob")
+        run_two_tables()
+
+
+if __name__ == "__main__":
+    main()
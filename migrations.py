@@ -0,0 +1,62 @@
+from typing import List
+from keys import get_engine
+from core_metadata import user_table, address_table, get_some_table
+from sqlalchemy import Index, inspect, text
+
+# Migrations
+"""
+metadata_obj.create_all() only creates tables that don't exist yet, it never adds an index to an existing table.
+The functions here bring an existing database up to date with the indexes declared in core_metadata.py.
+
+On MySQL the indexes are added with online DDL (ALGORITHM=INPLACE, LOCK=NONE), so reads and writes to the table
+carry on while the index is built. If the server can't do that for some index, the statement fails rather than
+silently locking the table. On other backends a plain CREATE INDEX is used.
+
+Run it with: `python migrations.py`
+"""
+
+
+def _add_index(conn, index: Index) -> None:
+    if conn.dialect.name == "mysql":
+        preparer = conn.dialect.identifier_preparer
+        columns = ", ".join(preparer.quote(c.name) for c in index.columns)
+        conn.execute(text(
+            f"ALTER TABLE {preparer.format_table(index.table)} "
+            f"ADD INDEX {preparer.quote(index.name)} ({columns}), ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+    else:
+        index.create(conn)
+
+
+def create_hot_lookup_indexes(engine=None) -> List[str]:
+    """
+    Creates the indexes of user_account, address and some_table that are declared in core_metadata.py
+    but missing in the database. Returns the names of the indexes that were created.<br>
+    An index is also skipped when the database already has another index starting with the same columns,
+    like the one MySQL creates by itself for the address.user_id foreign key.
+    """
+    engine = engine or get_engine()
+    created = []
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        tables = [user_table, address_table]
+        if inspector.has_table("some_table"):
+            tables.append(get_some_table(engine))
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = inspector.get_indexes(table.name)
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                columns = [c.name for c in index.columns]
+                if any(ix["name"] == index.name or ix["column_names"][:len(columns)] == columns for ix in existing):
+                    continue
+                _add_index(conn, index)
+                created.append(index.name)
+        conn.commit()
+    if any(name.startswith("ix_some_table_") for name in created):
+        get_some_table(engine, refresh=True) # the some_table loaded in this process doesn't have the new index yet
+    return created
+
+
+if __name__ == "__main__":
+    print(f"Created indexes: {create_hot_lookup_indexes()}")
@@ -0,0 +1,132 @@
+import contextlib
+import os
+import sys
+import threading
+import warnings
+from collections import Counter
+from typing import Iterator, List, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Detecting N+1 queries
+"""
+A lazy load is a SELECT that the ORM runs when a relationship attribute (like user.addresses) is touched for the
+first time. One is fine, but inside a loop over users it becomes one query per user, see orm.LOADER_STRATEGIES.
+
+The LazyLoadDetector listens to the Session "do_orm_execute" event, which tells us when a statement is a lazy load
+and which relationship it loads. It counts lazy loads per session and relationship, and per call site (the line in
+our code that touched the attribute). When the same relationship is lazily loaded more than `threshold` times in one
+session, it warns (NPlusOneWarning) or raises (NPlusOneError).
+
+The detector is opt-in, nothing is hooked until install() is called:
+
+`detector = LazyLoadDetector(threshold=10, action="raise").install()`
+
+For tests, assert_max_statements() puts an upper bound on the SQL a block of code may emit:
+
+`with assert_max_statements(1):`<br>
+`    users = orm.select_all_from_User()`
+
+That holds for any number of users, since addresses aren't loaded (loader="raise"). With an eager loader the
+count depends on the data: loader="selectin" loads the addresses of up to 500 users per extra query, so
+`orm.select_all_from_User(loader="selectin")` takes 1 + ceil(users / 500) statements, and the bound has to be
+computed from the number of users in the test.
+"""
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+_SQLALCHEMY_DIR = os.path.dirname(sys.modules["sqlalchemy"].__file__)
+
+
+def _call_site() -> str:
+    """The first frame outside SQLAlchemy and this module, as "file:line"."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_SQLALCHEMY_DIR) and filename != __file__:
+            return f"{os.path.basename(filename)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class LazyLoadDetector:
+    def __init__(self, threshold: int = 10, action: str = "warn"):
+        if action not in ("warn", "raise"):
+            raise ValueError(f"action must be 'warn' or 'raise', not {action!r}")
+        self.threshold = threshold
+        self.action = action
+        # (relationship, call site) -> number of lazy loads, over all sessions
+        self.call_sites: Counter = Counter()
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def install(self) -> "LazyLoadDetector":
+        if not self._installed:
+            event.listen(Session, "do_orm_execute", self._on_orm_execute)
+            self._installed = True
+        return self
+
+    def uninstall(self) -> None:
+        if self._installed:
+            event.remove(Session, "do_orm_execute", self._on_orm_execute)
+            self._installed = False
+
+    @staticmethod
+    def session_counts(session: Session) -> Counter:
+        """Lazy loads per relationship (e.g. "User.addresses") in `session`."""
+        return session.info.setdefault("lazy_loads", Counter())
+
+    def _on_orm_execute(self, orm_execute_state) -> None:
+        if orm_execute_state.lazy_loaded_from is None:
+            return
+        relationship = str(orm_execute_state.loader_strategy_path.path[-1])
+        call_site = _call_site()
+        with self._lock:
+            self.call_sites[(relationship, call_site)] += 1
+        counts = self.session_counts(orm_execute_state.session)
+        counts[relationship] += 1
+        if counts[relationship] == self.threshold + 1:
+            message = (
+                f"{relationship} was lazily loaded more than {self.threshold} times in one session "
+                f"(last at {call_site}), "
+                f"consider a loader option such as selectinload({relationship})"
+            )
+            if self.action == "raise":
+                raise NPlusOneError(message)
+            warnings.warn(message, NPlusOneWarning, stacklevel=2)
+
+    def report(self) -> List[Tuple[str, str, int]]:
+        """(relationship, call site, lazy loads), most frequent first."""
+        with self._lock:
+            return [(rel, site, n) for (rel, site), n in self.call_sites.most_common()]
+
+
+@contextlib.contextmanager
+def assert_max_statements(limit: int, engine=None) -> Iterator[List[str]]:
+    """
+    Fails with an AssertionError if the block executes more than `limit` SQL statements on `engine`
+    (by default keys.get_engine()). Yields the list of statements, for inspection in the test.
+    """
+    if engine is None:
+        from keys import get_engine
+        engine = get_engine()
+    statements: List[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    if len(statements) > limit:
+        listing = "\n".join(statements)
+        raise AssertionError(f"Expected at most {limit} statements, {len(statements)} were executed:\n{listing}")
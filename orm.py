@@ -1,8 +1,14 @@
-from keys import engine
+from keys import get_engine
+import query_cache
 from orm_metadata import User, Address
-from typing import List, Tuple
-from sqlalchemy import text, select
+from pagination import encode_cursor, decode_cursor
+from projections import UserView
+from second_level_cache import cached_get
+from statements import SELECT_X_Y_WHERE_Y_GREATER_THAN, UPDATE_SOME_TABLE_SET_Y_WHERE_X_IS
+from typing import Callable, Dict, Iterator, List, Tuple, Optional, Type, Union
+from sqlalchemy import inspect, select, update, func
 from sqlalchemy.orm import Session
+from sqlalchemy.orm import selectinload, joinedload, subqueryload, raiseload, lazyload
 
 # About Session() and ORM vs Connection() and Core:
 """
@@ -16,9 +22,8 @@ and in fact as the Session is used, it refers to a Connection internally which i
 
 
 def select_x_y_where_y_greater_than_number(number):
-    stmt = text("SELECT x, y FROM some_table WHERE y > :y ORDER BY x, y") # parameterized query :y
-    with Session(engine) as session:
-        result = session.execute(stmt, {"y": number})
+    with Session(get_engine()) as session:
+        result = session.execute(SELECT_X_Y_WHERE_Y_GREATER_THAN, {"y": number}) # parameterized query :y
         for row in result:
             print(f"x: {row.x}, y: {row.y}")
 
@@ -32,12 +37,13 @@ illustrated below using a textual UPDATE statement to alter some of our data:
 """
 
 def commit_as_you_go_session_example():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         result = session.execute(
-            text("UPDATE some_table SET y=:y WHERE x=:x"),
+            UPDATE_SOME_TABLE_SET_Y_WHERE_X_IS,
             [{"x": 9, "y": 11}, {"x": 13, "y": 15}],
         )
         session.commit()
+    query_cache.invalidate("some_table")
 
 # Using SELECT Statements
 """
@@ -55,25 +61,128 @@ Row objects have only one element, which contain instances of the User class, as
 Row objects contain the actual data from the database.
 """
 
-def select_users_from_User_where_name_is(name):
+# Relationship loading strategies
+"""
+User.addresses and Address.user are "lazy" by default (lazy="select"): the related objects are loaded with a SELECT
+the first time the attribute is touched. Looping over 10.000 users and reading user.addresses therefore runs
+10.001 queries, the "N+1 problem". The query functions below take a `loader` argument in stead:
+
+* "selectin": one extra SELECT ... WHERE user_id IN (...) for all loaded users. The best default for collections.
+* "joined":   LEFT OUTER JOIN in the same query. One round trip, but the user columns repeat per address.
+* "subquery": one extra SELECT that repeats the original query as a subquery. Mostly superseded by "selectin".
+* "raise":    don't load, and raise an error on access. Makes accidental lazy loads visible.
+* "lazy":     the default lazy="select" behaviour.
+
+See benchmarks.py loader-strategies for the query count and latency of each.
+"""
+LOADER_STRATEGIES = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "subquery": subqueryload,
+    "raise": raiseload,
+    "lazy": lazyload,
+}
+
+def loader_option(loader:str, attribute):
+    """Returns the loader option for `attribute` (e.g. User.addresses), see LOADER_STRATEGIES."""
+    if loader not in LOADER_STRATEGIES:
+        raise ValueError(f"Unknown loader {loader!r}, expected one of {sorted(LOADER_STRATEGIES)}")
+    return LOADER_STRATEGIES[loader](attribute)
+
+def select_users_from_User_where_name_is(name, loader:str="raise"):
+    """Prints the users named `name`. Addresses aren't used, so by default they aren't loaded (loader="raise")."""
     # See orm_metadata.py for User class
-    stmt = select(User).where(User.name == name)
-    with Session(engine) as session:
-        for row in session.execute(stmt):
+    stmt = select(User).where(User.name == name).options(loader_option(loader, User.addresses))
+    with Session(get_engine()) as session:
+        for row in session.execute(stmt).unique():
             # The actual User object sits at row.User
             user_obj = row.User
             print(f'user: {user_obj}')
             print(f'user.fullname: {user_obj.fullname}')
 
-select_users_from_User_where_name_is("spongebob")
+def select_all_from_User(loader:str="raise") -> List[User]:
+    """
+    The users are returned after the session is closed, where lazy loading is no longer possible.
+    By default User.addresses isn't loaded and raises when accessed (loader="raise"). Callers that need the
+    addresses pass a loader, e.g. loader="selectin" for one extra query per 500 users.
+    ### Example:
+    `users = select_all_from_User(loader="selectin")`
+    """
+    stmt = select(User).options(loader_option(loader, User.addresses))
+    with Session(get_engine()) as session:
+        # .unique() is required when a collection is loaded with "joined"
+        return [row.User for row in session.execute(stmt).unique()]
 
-def select_all_from_User() -> List[User]:
-    stmt = select(User)
-    with Session(engine) as session:
-        return [row.User for row in session.execute(stmt)]
+def stream_all_from_User(batch_size:int=1000, read_only:bool=True) -> Iterator[User]:
+    """
+    Constant-memory alternative to select_all_from_User() for batch jobs over the whole user_account table.<br>
+
+    `yield_per` fetches the users `batch_size` at a time through a server-side cursor, and every batch is removed
+    from the session (expunged) once it is done, so the identity map never holds more than one batch and the
+    objects can be garbage collected as soon as the caller drops them.
+
+    Relationships are not loaded (raiseload("*")): while the rows are streamed the connection is busy, so a lazy
+    load of user.addresses would need a second query on the same connection, which MySQL doesn't allow. For the
+    same reason changes can't be flushed on the streaming connection.
+
+    * With `read_only` (the default) the batch is expunged before its users are yielded. Changes to them are
+      not saved.
+    * With `read_only=False` the users are yielded while still attached, and when the caller asks for the first
+      user of the next batch (or the loop ends), the changed columns of the previous batch are written by primary
+      key through a second session, on another connection, and committed. Leaving the loop early (break, an
+      exception) discards the changes of the batch that was being processed. For changes that can be computed
+      from the columns alone, transform_users() is simpler. On SQLite this needs the database in WAL mode
+      (PRAGMA journal_mode=WAL), otherwise the open read keeps the second session from committing.
+    ### Example:
+    `for user in stream_all_from_User(batch_size=5000, read_only=False):`<br>
+    `    user.fullname = user.fullname.title()`
+    """
+    stmt = select(User).order_by(User.id).execution_options(yield_per=batch_size).options(raiseload("*"))
+    engine = get_engine("batch")
+
+    with Session(engine, autoflush=False) as session, Session(engine) as writer:
+        conn = session.connection()
+        exhausted = False
+        try:
+            for partition in session.execute(stmt).scalars().partitions():
+                if read_only:
+                    for user_obj in partition:
+                        session.expunge(user_obj)
+                    yield from partition
+                else:
+                    yield from partition
+                    _write_changes(writer, partition)
+                    for user_obj in partition:
+                        session.expunge(user_obj)
+            exhausted = True
+        finally:
+            if not exhausted:
+                # The server-side cursor still has rows, so don't give this connection back to the pool
+                conn.invalidate()
+
+def _write_changes(writer:Session, user_objects:List[User]) -> None:
+    """Writes the changed column attributes of `user_objects` with one UPDATE by primary key, and commits."""
+    changes = []
+    for user_obj in user_objects:
+        state = inspect(user_obj)
+        changed = {}
+        for attr in state.mapper.column_attrs:
+            history = state.attrs[attr.key].history
+            if history.added:
+                changed[attr.key] = history.added[0]
+        if changed:
+            changes.append({**changed, "id": state.identity[0]})
+    if changes:
+        writer.execute(update(User), changes)
+        writer.commit()
+        query_cache.invalidate("user_account")
 
 def example_use_of_select_all_from_User_then_do_something() -> List[User]:
-    """Selects all User objects from the db and returns an altered copy of each User object, as a list."""
+    """
+    Selects all User objects from the db and returns an altered copy of each User object, as a list.<br>
+    This loads every user into memory. To actually change the users in the database, see
+    append_to_fullname() and transform_users() below.
+    """
     user_objects = select_all_from_User()
     altered_users = map(lambda user: User(name=user.name, fullname=user.fullname + " ALTERED"), user_objects)
     print("Returning altered users:")
@@ -81,18 +190,129 @@ def example_use_of_select_all_from_User_then_do_something() -> List[User]:
         print(f'Changed fullname to "{user.fullname}", for user {user.name}')
     return altered_users
 
-def select_from_two_tables() -> List[Tuple[str, Address]]:
-    """Returns a list of tuples containing User.name (str) and the corresponding Address object."""
-    stmt = select(User.name, Address).where(User.id == Address.user_id).order_by(Address.id)
+# Bulk transformations
+"""
+Changing every user by loading it as an object, modifying it and flushing it costs one object and one UPDATE
+round trip per row. If the change can be written in SQL, one set-based UPDATE does it all in the database:
+
+    UPDATE user_account SET fullname = CONCAT(fullname, :suffix)
+
+If it can't (arbitrary Python logic), we read the rows page by page as lightweight tuples and write the changes
+back in batches with an ORM bulk UPDATE by primary key (one executemany per batch).
+"""
+
+def append_to_fullname(suffix:str, chunk_size:Optional[int]=None) -> int:
+    """
+    Appends `suffix` to every user's fullname with a single set-based UPDATE. Returns the number of updated rows.<br>
+    With `chunk_size`, the update is split into ranges of `chunk_size` ids, each in its own transaction,
+    so a huge table isn't locked in one long transaction.
+    ### Example:
+    `append_to_fullname(" ALTERED")`
+    """
+    if chunk_size is not None and chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, not {chunk_size}")
+    # "+" on string columns renders as CONCAT() on MySQL and as || on SQLite
+    stmt = update(User).values(fullname=User.fullname + suffix).execution_options(synchronize_session=False)
+    engine = get_engine("batch")
+    if chunk_size is None:
+        with Session(engine) as session, session.begin():
+            updated = session.execute(stmt).rowcount
+        query_cache.invalidate("user_account")
+        return updated
+
     with Session(engine) as session:
+        min_id, max_id = session.execute(select(func.min(User.id), func.max(User.id))).one()
+    if min_id is None:
+        return 0
+    updated = 0
+    for start in range(min_id, max_id + 1, chunk_size):
+        with Session(engine) as session, session.begin():
+            updated += session.execute(stmt.where(User.id >= start, User.id < start + chunk_size)).rowcount
+        query_cache.invalidate("user_account")
+    return updated
+
+def transform_users(transform:Callable[[UserView], Optional[Dict[str, object]]], batch_size:int=1000) -> int:
+    """
+    Applies an arbitrary Python `transform` to every user. Returns the number of updated users.<br>
+    `transform` gets a projections.UserView and returns a dict of the columns to change, or None to leave the
+    user as it is. The users are read `batch_size` at a time with keyset pagination (see pagination.py), so no
+    cursor stays open while we write, and each batch of changes is written with `update(User)` by primary key
+    (one executemany) in its own transaction.
+    ### Example:
+    `transform_users(lambda user: {"fullname": user.fullname.title()})`
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, not {batch_size}")
+    page = select(User.id, User.name, User.fullname).order_by(User.id).limit(batch_size)
+    updated = 0
+    last_id = None
+    with Session(get_engine("batch")) as session:
+        while True:
+            stmt = page if last_id is None else page.where(User.id > last_id)
+            user_views = [UserView._make(row) for row in session.execute(stmt)]
+            if not user_views:
+                break
+            last_id = user_views[-1].id
+            changes = []
+            for user_view in user_views:
+                changed = transform(user_view)
+                if changed:
+                    changes.append({**changed, "id": user_view.id})
+            if changes:
+                session.execute(update(User), changes)
+                updated += len(changes)
+            session.commit()
+            query_cache.invalidate("user_account")
+    return updated
+
+def select_from_two_tables(loader:str="raise") -> List[Tuple[str, Address]]:
+    """
+    Returns a list of tuples containing User.name (str) and the corresponding Address object.<br>
+    The user name is already part of each row, so Address.user isn't loaded by default (loader="raise").
+    """
+    stmt = (
+        select(User.name, Address)
+        .where(User.id == Address.user_id)
+        .order_by(Address.id)
+        .options(loader_option(loader, Address.user))
+    )
+    with Session(get_engine()) as session:
         return session.execute(stmt).all()  
         # .all() returns a list of all rows. Without it, we get a Result object.
         # if we in stead use .first() we get the first row as a Row object.
 
-result_from_two_tables = select_from_two_tables()
-print(f'\n{len(result_from_two_tables)} rows returned:\n')
-for row in result_from_two_tables:
-    print(row)
+def select_one_of(entity:Type[Union[User, Address]], pk:int) -> Optional[Union[User, Address]]:
+    """
+    Returns the User or Address with primary key `pk`, or None.<br>
+    Served from the second-level cache when it is enabled (see second_level_cache.py), so a hit runs no SQL.
+    The object is returned after the session is closed, so its relationships can't be loaded.
+    ### Example:
+    `user = select_one_of(User, 5)`
+    """
+    with Session(get_engine()) as session:
+        return cached_get(session, entity, pk)
+
+def select_page_of(entity:Type[Union[User, Address]], cursor:Optional[str]=None, page_size:int=100) -> Tuple[List[Union[User, Address]], Optional[str]]:
+    """
+    Keyset pagination over User or Address objects (see pagination.py).<br>
+    Returns the objects of the page and the cursor for the next page, which is None on the last page.
+    ### Example:
+    `users, cursor = select_page_of(User)`<br>
+    `users, cursor = select_page_of(User, cursor)`
+    """
+    if page_size < 1:
+        raise ValueError(f"page_size must be at least 1, not {page_size}")
+    stmt = select(entity).order_by(entity.id).limit(page_size + 1) # one extra row tells us if there is a next page
+    last_id = decode_cursor(entity.__tablename__, cursor)
+    if last_id is not None:
+        stmt = stmt.where(entity.id > last_id)
+
+    with Session(get_engine()) as session:
+        objects = session.scalars(stmt).all()
+    if len(objects) <= page_size:
+        return list(objects), None
+    objects = objects[:page_size]
+    return list(objects), encode_cursor(entity.__tablename__, objects[-1].id)
 
 # TODO: Continue here: Selecting from Labeled SQL Expressions
 # https://docs.sqlalchemy.org/en/20/tutorial/data_select.html
\ No newline at end of file
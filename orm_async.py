@@ -0,0 +1,81 @@
+from keys import get_async_engine
+from orm_metadata import User, Address
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, insert
+from sqlalchemy.orm import selectinload, raiseload
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+# About AsyncSession:
+"""
+This module mirrors the read paths of orm.py on an AsyncSession (see core_async.py for the Core version).
+
+The one thing to watch out for with the ORM in async code is lazy loading: touching `user.addresses` on a User
+that was loaded without its addresses would have to run a query right there, inside a plain attribute access,
+which can't be awaited. SQLAlchemy raises an error (MissingGreenlet) in stead. So every function below says up
+front what it loads:
+* selectinload(User.addresses) loads the addresses of all returned users with one extra SELECT ... WHERE user_id IN (...)
+* raiseload(...) turns any other relationship access into an immediate, clear error in stead of hidden I/O
+
+Sessions are created with expire_on_commit=False, so the returned objects can still be read after the session
+is closed.
+"""
+
+_sessionmaker: Optional[async_sessionmaker] = None
+
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    global _sessionmaker
+    if _sessionmaker is None:
+        _sessionmaker = async_sessionmaker(get_async_engine(), expire_on_commit=False)
+    return _sessionmaker
+
+
+async def select_users_from_User_where_name_is(name:str) -> List[User]:
+    """Returns the users named `name`, with their addresses loaded."""
+    stmt = (
+        select(User)
+        .where(User.name == name)
+        .options(selectinload(User.addresses).raiseload(Address.user))
+    )
+    async with get_async_sessionmaker()() as session:
+        return list(await session.scalars(stmt))
+
+async def select_all_from_User() -> List[User]:
+    stmt = select(User).options(selectinload(User.addresses).raiseload(Address.user))
+    async with get_async_sessionmaker()() as session:
+        return list(await session.scalars(stmt))
+
+async def select_from_two_tables() -> List[Tuple[str, Address]]:
+    """Returns a list of tuples containing User.name (str) and the corresponding Address object."""
+    stmt = (
+        select(User.name, Address)
+        .where(User.id == Address.user_id)
+        .order_by(Address.id)
+        .options(raiseload(Address.user)) # the name is already in the row
+    )
+    async with get_async_sessionmaker()() as session:
+        result = await session.execute(stmt)
+        return result.all()
+
+async def insert_users_with_addresses(users:List[Dict[str, object]]) -> int:
+    """
+    Inserts users and their addresses in one transaction. Returns the number of inserted users.<br>
+    Each dictionary has "name", "fullname" and optionally "addresses", a list of email addresses.
+
+    The User objects are flushed first to get their ids (MySQL has no INSERT ... RETURNING, so that is one
+    INSERT per user), after which all addresses are sent with a single executemany.
+    ### Example:
+    `await insert_users_with_addresses([{"name": "sandy", "fullname": "Sandy Cheeks", "addresses": ["sandy@sqlalchemy.org"]}])`
+    """
+    async with get_async_sessionmaker().begin() as session:
+        user_objects = [User(name=u["name"], fullname=u.get("fullname")) for u in users]
+        session.add_all(user_objects)
+        await session.flush()
+        address_rows = [
+            {"user_id": user_obj.id, "email_address": email}
+            for user_obj, u in zip(user_objects, users)
+            for email in u.get("addresses", ())
+        ]
+        if address_rows:
+            await session.execute(insert(Address), address_rows)
+    return len(user_objects)
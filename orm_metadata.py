@@ -1,4 +1,3 @@
-from keys import engine
 from sqlalchemy import ForeignKey, String
 from sqlalchemy.orm import DeclarativeBase
 
@@ -112,7 +111,7 @@ class User(Base):
     """
     __tablename__ = "user_account"
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(30))
+    name: Mapped[str] = mapped_column(String(30), index=True)
     fullname: Mapped[Optional[str]] = mapped_column(String(255))
     addresses: Mapped[List["Address"]] = relationship(back_populates="user")
     def __repr__(self) -> str:
@@ -121,8 +120,8 @@ class User(Base):
 class Address(Base):
     __tablename__ = "address"
     id: Mapped[int] = mapped_column(primary_key=True)
-    email_address: Mapped[str] = mapped_column(String(255))
-    user_id = mapped_column(ForeignKey("user_account.id"))
+    email_address: Mapped[str] = mapped_column(String(255), index=True)
+    user_id = mapped_column(ForeignKey("user_account.id"), index=True)
     user: Mapped[User] = relationship(back_populates="addresses")
     def __repr__(self) -> str:
         return f"Address(id={self.id!r}, email_address={self.email_address!r})"
@@ -0,0 +1,41 @@
+import base64
+import json
+from typing import Optional
+
+# Keyset (seek) pagination
+"""
+OFFSET pagination (`LIMIT 100 OFFSET 1000000`) makes the database read and throw away every row before
+the page, so page N gets slower the further you go. Keyset pagination remembers the last primary key of
+the previous page in stead:
+
+    SELECT ... WHERE id > :last_id ORDER BY id LIMIT :n
+
+The primary key index takes us straight to the start of the page, so page N costs the same as page 1.
+
+The last id is handed to the caller as an opaque cursor token. The token also names the table it came
+from, so a token from one table can't be used to page through another one by mistake.
+See core.select_page_from_table() and orm.select_page_of() for the actual queries.
+
+* Note: some_table has no primary key (just x and y), so it can't be paged this way.
+"""
+
+
+def encode_cursor(table_name: str, last_id: int) -> str:
+    payload = json.dumps({"t": table_name, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(table_name: str, cursor: Optional[str]) -> Optional[int]:
+    """Returns the last id stored in `cursor`, or None for the first page."""
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        last_id = payload["id"]
+        cursor_table = payload["t"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {cursor!r}") from e
+    if cursor_table != table_name or not isinstance(last_id, int):
+        raise ValueError(f"Page cursor {cursor!r} does not belong to table {table_name!r}")
+    return last_id
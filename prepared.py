@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+from sqlalchemy.dialects import mysql
+from keys import get_engine
+from statements import registry
+
+# Server-side prepared statements for hot point queries
+"""
+PyMySQL fills the parameters into the SQL on the client and sends the complete statement as text, so MySQL parses
+`SELECT * FROM some_table WHERE x = 5` from scratch on every call. With a server-side prepared statement the SQL is
+parsed once (COM_STMT_PREPARE) and every call only sends the statement id and the parameters in the binary protocol
+(COM_STMT_EXECUTE), and the rows come back in binary as well.
+
+PyMySQL can't do that, so the "prepared" engine profile connects through mysql-connector (see PROFILE_DRIVERS in
+keys.py), and execute_prepared() runs the statements from statements.py listed in HOT_QUERIES on a
+`cursor(prepared=True)` of that connection. The cursor is kept in the pooled connection's info dict, so each
+statement is prepared once per connection and after that only executed.
+
+The mode is off by default. Turn it on with enable_prepared_statements() or SQLALCHEMY_PREPARED_STATEMENTS=1, and
+core.select_all_from_some_table_where_x_is() and core.select_all_from_user_table_where_name_is() use it.
+The rows come back as named tuples of the cursor's columns, so they work like SQLAlchemy's Row objects:
+row.x, row[0], tuple unpacking and row._asdict(). On other backends than MySQL execute_prepared() just executes
+the statement through SQLAlchemy and returns its Rows.
+
+See benchmarks.py prepared for client and server CPU per query, with and without prepared statements.
+"""
+
+HOT_QUERIES = ("select_all_from_some_table_where_x_is", "select_all_from_user_table_where_name_is")
+
+_enabled = os.getenv("SQLALCHEMY_PREPARED_STATEMENTS") == "1"
+_compiled: Dict[str, Tuple[str, List[str]]] = {}
+_counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"prepares": 0, "executions": 0})
+_lock = threading.Lock()
+
+
+def enable_prepared_statements() -> None:
+    global _enabled
+    _enabled = True
+
+def disable_prepared_statements() -> None:
+    global _enabled
+    _enabled = False
+
+def prepared_statements_enabled() -> bool:
+    return _enabled
+
+def _compile(name: str) -> Tuple[str, List[str]]:
+    """The SQL of a hot query with %s placeholders, and the parameter names in placeholder order."""
+    compiled = _compiled.get(name)
+    if compiled is None:
+        if name not in HOT_QUERIES:
+            raise ValueError(f"{name!r} is not a hot query, expected one of {HOT_QUERIES}")
+        stmt = registry[name].compile(dialect=mysql.dialect(paramstyle="format"))
+        compiled = _compiled.setdefault(name, (stmt.string, list(stmt.positiontup)))
+    return compiled
+
+@lru_cache(maxsize=None)
+def _row_type(column_names: Tuple[str, ...]) -> type:
+    # rename=True turns column names that are not valid identifiers (e.g. "COUNT(*)") into _0, _1, ...
+    return namedtuple("PreparedRow", column_names, rename=True)
+
+def execute_prepared(name: str, parameters: Mapping[str, Any]) -> Sequence[Tuple]:
+    """Runs the hot query `name` (see HOT_QUERIES) as a server-side prepared statement and returns all rows."""
+    engine = get_engine("prepared")
+    with engine.connect() as conn:
+        if engine.dialect.name != "mysql":
+            return conn.execute(registry[name], dict(parameters)).all()
+        sql, parameter_names = _compile(name)
+        dbapi_connection = conn.connection
+        cursors = dbapi_connection.info.setdefault("prepared_cursors", {})
+        cursor = cursors.get(name)
+        if cursor is None:
+            cursor = cursors[name] = dbapi_connection.driver_connection.cursor(prepared=True)
+            _count(name, "prepares")
+        # mysql-connector only prepares again when it gets another SQL string object than last time,
+        # so it must always be the same str from _compile()
+        cursor.execute(sql, tuple(parameters[p] for p in parameter_names))
+        _count(name, "executions")
+        row_type = _row_type(tuple(cursor.column_names))
+        return [row_type._make(row) for row in cursor.fetchall()]
+
+def _count(name: str, counter: str) -> None:
+    with _lock:
+        _counters[name][counter] += 1
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Statements prepared and executed per hot query. Prepares should stay around the pool size."""
+    with _lock:
+        return {name: dict(counters) for name, counters in _counters.items()}
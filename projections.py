@@ -0,0 +1,71 @@
+from keys import get_engine
+from core_metadata import user_table, address_table
+from core import stream_all_from_table
+from typing import Iterator, List, NamedTuple, Optional
+from sqlalchemy import select
+
+# Read-only projections
+"""
+select_all_from_User() and select_from_two_tables() in orm.py build full ORM objects: every User gets an
+InstanceState for change tracking, a __dict__ and a place in the session's identity map. Callers that only
+read name / fullname / email_address pay for all of that for nothing.
+
+The views below are NamedTuples: plain tuples with named fields, no __dict__ and no instrumentation. They are
+filled straight from Core column selects, so no ORM machinery is involved at all. They can't be modified
+or saved back, use the ORM for that.
+
+See benchmarks.py projections for rows/sec and bytes per row compared to ORM objects.
+"""
+
+
+class UserView(NamedTuple):
+    id: int
+    name: str
+    fullname: Optional[str]
+
+
+class AddressView(NamedTuple):
+    id: int
+    user_id: int
+    email_address: str
+
+
+class UserAddressView(NamedTuple):
+    name: str
+    address_id: int
+    email_address: str
+
+
+def select_all_users() -> List[UserView]:
+    """Projection version of orm.select_all_from_User()."""
+    stmt = select(user_table.c.id, user_table.c.name, user_table.c.fullname)
+    with get_engine().connect() as conn:
+        return list(map(UserView._make, conn.execute(stmt)))
+
+def select_users_where_name_is(name:str) -> List[UserView]:
+    stmt = select(user_table.c.id, user_table.c.name, user_table.c.fullname).where(user_table.c.name == name)
+    with get_engine().connect() as conn:
+        return list(map(UserView._make, conn.execute(stmt)))
+
+def select_addresses_of_user(user_id:int) -> List[AddressView]:
+    stmt = (
+        select(address_table.c.id, address_table.c.user_id, address_table.c.email_address)
+        .where(address_table.c.user_id == user_id)
+        .order_by(address_table.c.id)
+    )
+    with get_engine().connect() as conn:
+        return list(map(AddressView._make, conn.execute(stmt)))
+
+def select_user_names_and_addresses() -> List[UserAddressView]:
+    """Projection version of orm.select_from_two_tables()."""
+    stmt = (
+        select(user_table.c.name, address_table.c.id, address_table.c.email_address)
+        .join_from(user_table, address_table)
+        .order_by(address_table.c.id)
+    )
+    with get_engine().connect() as conn:
+        return list(map(UserAddressView._make, conn.execute(stmt)))
+
+def stream_all_users(batch_size:int=1000) -> Iterator[UserView]:
+    """Constant-memory version of select_all_users(), see core.stream_all_from_table()."""
+    return map(UserView._make, stream_all_from_table(user_table.name, batch_size, UserView._fields))
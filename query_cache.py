@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+# Read-through result cache
+"""
+Lookups like core.select_all_from_some_table_where_x_is(x) and core.select_all_from_user_table_where_name_is(name)
+go to MySQL on every call, even though most traffic asks for the same few keys. With the cache enabled, their
+results are kept in memory, keyed by the statement and its parameters:
+
+`enable_result_cache(max_size=10_000, ttl=30)`
+
+Results are shared by every caller, so they are stored as tuples (Rows are immutable already).
+
+Invalidation is done per table with generation numbers: every cached result is stored under the current
+generation of the tables it reads, and the insert/delete functions in core.py (and the bulk writers in orm.py and
+coalescer.py) call invalidate("user_account") etc. after writing, which bumps the generation. Old entries can then
+never be hit again and simply age out of the LRU. Writes that don't go through this repo's functions are only
+picked up when the entry expires (ttl).
+
+The cache is off by default. Storage is pluggable: LRUTTLBackend is the in-process default, and a shared backend
+(e.g. Redis, so that several processes share results and invalidations) only has to implement CacheBackend.
+"""
+
+MISSING = object()
+
+
+class CacheBackend:
+    """Interface for result cache storage. Values must be stored as-is (or serialized and restored)."""
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the value stored under `key`, or MISSING."""
+        raise NotImplementedError
+
+    def set(self, key: Hashable, value: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+    def get_generation(self, table: str) -> int:
+        raise NotImplementedError
+
+    def bump_generation(self, table: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+class LRUTTLBackend(CacheBackend):
+    """In-process LRU cache with a time-to-live, holding at most `max_size` results."""
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_generation(self, table: str) -> int:
+        return self._generations.get(table, 0)
+
+    def bump_generation(self, table: str) -> None:
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "evictions": self.evictions, "expirations": self.expirations}
+
+
+class ResultCache:
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, tables: Sequence[str], key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Every caller gets the same cached object, so results must be immutable: loaders return tuples,
+        and a list is turned into a tuple before it is stored.
+        """
+        # The generations are read before loading: if a write lands while we load, the result is
+        # stored under the old generation and can't be served after the invalidation.
+        full_key = (tuple(self.backend.get_generation(t) for t in tables), key)
+        value = self.backend.get(full_key)
+        with self._lock:
+            if value is not MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = loader()
+        if isinstance(value, list):
+            value = tuple(value)
+        self.backend.set(full_key, value)
+        return value
+
+    def invalidate(self, *tables: str) -> None:
+        for table in tables:
+            self.backend.bump_generation(table)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, **self.backend.stats()}
+
+
+_result_cache: Optional[ResultCache] = None
+_invalidation_listeners: List[Callable[[str], None]] = []
+
+
+def enable_result_cache(backend: Optional[CacheBackend] = None, max_size: int = 10_000, ttl: float = 30.0) -> ResultCache:
+    """Turns the result cache on, with `backend` or else an in-process LRUTTLBackend(max_size, ttl)."""
+    global _result_cache
+    _result_cache = ResultCache(backend or LRUTTLBackend(max_size, ttl))
+    return _result_cache
+
+
+def disable_result_cache() -> None:
+    global _result_cache
+    _result_cache = None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    return _result_cache
+
+
+def cached(tables: Sequence[str], key: Hashable, loader: Callable[[], Any]) -> Any:
+    """Returns the cached result for `key` (reading `tables`), or calls `loader` when missing or disabled."""
+    if _result_cache is None:
+        return loader()
+    return _result_cache.get_or_load(tables, key, loader)
+
+
+def invalidate(*tables: str) -> None:
+    """Call after writing to `tables`, so cached results that read them are not served anymore."""
+    if _result_cache is not None:
+        _result_cache.invalidate(*tables)
+    for listener in _invalidation_listeners:
+        for table in tables:
+            listener(table)
+
+
+def add_invalidation_listener(listener: Callable[[str], None]) -> None:
+    """Calls `listener(table)` on every invalidate(), for other caches (see second_level_cache.py)."""
+    _invalidation_listeners.append(listener)
+
+
+def remove_invalidation_listener(listener: Callable[[str], None]) -> None:
+    _invalidation_listeners.remove(listener)
@@ -0,0 +1,227 @@
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional, Sequence, Type
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from orm_metadata import User, Address
+import query_cache
+from query_cache import LRUTTLBackend, MISSING
+
+# Second-level (cross-session) cache for User and Address
+"""
+Every Session has its own identity map, which starts out empty. So every request that does
+session.get(User, 5) runs the same SELECT again, even when user 5 hasn't changed in hours.
+
+The SecondLevelCache keeps the column values of User and Address objects by primary key, across sessions:
+* filling: every time the ORM loads a User/Address from the database (the "load" and "refresh" events),
+  its column values are stored.
+* reading: cached_get(session, User, 5) looks in the session, then in the cache, and only then in the database.
+  orm.select_one_of() reads through it.
+  A cache hit puts a persistent object into the session without any SQL. Relationships (user.addresses)
+  are not cached, they load as usual.
+* invalidation: after_flush and after_commit evict every User/Address the session changed or deleted.
+  A session that has flushed changes doesn't store anything until its transaction ends, so uncommitted values
+  never end up in the cache. Bulk writes that go through query_cache.invalidate() (core.py, orm.py) drop all
+  cached entries of that table.
+* versions: a session may have read a row before another session changed it and evicted it (an older snapshot
+  in REPEATABLE READ, or simply a SELECT that ran just before the other commit). So every eviction gets a new
+  version number, and every session transaction remembers the latest version when it began. A loaded object
+  is only stored if its key (and its table) wasn't evicted since then, like the generations in query_cache.py.
+
+The cache is bounded (LRU with max_size entries and a ttl, see query_cache.LRUTTLBackend) and keeps
+hit/miss/store/invalidation counters per entity (stale_loads: loaded objects that were not stored because
+they had been evicted in the meantime).
+
+### Example:
+`l2 = SecondLevelCache(max_size=50_000).install()`<br>
+`user = cached_get(session, User, 5)`
+"""
+
+_FLUSHED = "second_level_cache_flushed"
+_BEGAN_AT = "second_level_cache_began_at"
+
+
+class SecondLevelCache:
+    def __init__(self, max_size: int = 10_000, ttl: float = 300.0, entities: Sequence[Type] = (User, Address)):
+        self.entities = tuple(entities)
+        self.backend = LRUTTLBackend(max_size, ttl)
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+        self._installed = False
+        # Eviction versions: per key, and per table for invalidate_table() and for keys dropped from _versions
+        self._version = 0
+        self._versions: "OrderedDict[tuple, int]" = OrderedDict()
+        self._table_versions: Dict[str, int] = {}
+        self._max_versions = max(max_size, 1000)
+        self._version_lock = threading.Lock()
+
+    # -- keys and counters
+
+    def _key(self, entity: Type, pk: Any) -> tuple:
+        table = entity.__tablename__
+        return (table, self.backend.get_generation(table), pk)
+
+    def _count(self, entity: Type, counter: str) -> None:
+        with self._lock:
+            self.counters[entity.__name__][counter] += 1
+
+    # -- public API
+
+    def get(self, session: Session, entity: Type, pk: Any) -> Optional[Any]:
+        """Returns the object from the session or the cache (without SQL), or None if neither has it."""
+        identity_key = session.identity_key(entity, pk)
+        if identity_key in session.identity_map:
+            return session.identity_map[identity_key]
+        values = self.backend.get(self._key(entity, pk))
+        if values is MISSING:
+            self._count(entity, "misses")
+            return None
+        self._count(entity, "hits")
+        instance = inspect(entity).class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(instance, key, value)
+        make_transient_to_detached(instance)
+        session.add(instance)
+        return instance
+
+    def current_version(self) -> int:
+        """Take this before reading from the database, and pass it to store() with what was read."""
+        return self._version
+
+    def store(self, instance: Any, read_at: int) -> None:
+        """Caches `instance`, unless it was evicted after version `read_at` (then it may be stale)."""
+        state = inspect(instance)
+        mapper = state.mapper
+        values = {}
+        for attr in mapper.column_attrs:
+            if attr.key not in state.dict:
+                return # partially loaded (deferred columns), don't cache
+            values[attr.key] = state.dict[attr.key]
+        entity = mapper.class_
+        pk = state.identity[0]
+        table = entity.__tablename__
+        with self._version_lock:
+            evicted_at = max(self._versions.get((table, pk), 0), self._table_versions.get(table, 0))
+            if evicted_at > read_at:
+                stored = False
+            else:
+                self.backend.set(self._key(entity, pk), values)
+                stored = True
+        self._count(entity, "stores" if stored else "stale_loads")
+
+    def evict(self, entity: Type, pk: Any) -> None:
+        table = entity.__tablename__
+        with self._version_lock:
+            self._version += 1
+            self._versions[(table, pk)] = self._version
+            self._versions.move_to_end((table, pk))
+            while len(self._versions) > self._max_versions:
+                # Forgetting a key's version is safe as long as its table's version covers it
+                (old_table, _), version = self._versions.popitem(last=False)
+                self._table_versions[old_table] = max(self._table_versions.get(old_table, 0), version)
+            self.backend.delete(self._key(entity, pk))
+        self._count(entity, "invalidations")
+
+    def invalidate_table(self, table: str) -> None:
+        """Drops all cached objects of `table`, e.g. after a bulk UPDATE that the Session didn't see."""
+        with self._version_lock:
+            self._version += 1
+            self._table_versions[table] = self._version
+            self.backend.bump_generation(table)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            per_entity = {name: dict(counters) for name, counters in self.counters.items()}
+        return {"entities": per_entity, **self.backend.stats()}
+
+    # -- events
+
+    def install(self) -> "SecondLevelCache":
+        if not self._installed:
+            for entity in self.entities:
+                event.listen(entity, "load", self._on_load)
+                event.listen(entity, "refresh", self._on_refresh)
+            event.listen(Session, "after_begin", self._after_begin)
+            event.listen(Session, "after_flush", self._after_flush)
+            event.listen(Session, "after_commit", self._after_transaction)
+            event.listen(Session, "after_soft_rollback", self._after_rollback)
+            event.listen(Session, "after_transaction_end", self._after_transaction_end)
+            query_cache.add_invalidation_listener(self.invalidate_table)
+            self._installed = True
+        return self
+
+    def uninstall(self) -> None:
+        if self._installed:
+            for entity in self.entities:
+                event.remove(entity, "load", self._on_load)
+                event.remove(entity, "refresh", self._on_refresh)
+            event.remove(Session, "after_begin", self._after_begin)
+            event.remove(Session, "after_flush", self._after_flush)
+            event.remove(Session, "after_commit", self._after_transaction)
+            event.remove(Session, "after_soft_rollback", self._after_rollback)
+            event.remove(Session, "after_transaction_end", self._after_transaction_end)
+            query_cache.remove_invalidation_listener(self.invalidate_table)
+            self._installed = False
+
+    def _on_load(self, instance, context) -> None:
+        info = context.session.info
+        if not info.get(_FLUSHED) and _BEGAN_AT in info:
+            self.store(instance, info[_BEGAN_AT])
+
+    def _on_refresh(self, instance, context, attrs) -> None:
+        self._on_load(instance, context)
+
+    def _after_begin(self, session: Session, transaction, connection) -> None:
+        # Before the transaction's first statement, so before its snapshot (and anything it reads)
+        session.info.setdefault(_BEGAN_AT, self.current_version())
+
+    def _after_flush(self, session: Session, flush_context) -> None:
+        # New objects can't be cached yet, only changed and deleted ones need evicting
+        changed = session.info.setdefault(_FLUSHED, set())
+        for instance in list(session.dirty) + list(session.deleted):
+            if isinstance(instance, self.entities):
+                identity = inspect(instance).identity
+                if identity is not None:
+                    changed.add((type(instance), identity[0]))
+        for entity, pk in changed:
+            self.evict(entity, pk)
+
+    def _after_transaction(self, session: Session) -> None:
+        # Evict again: another session may have cached the old values between our flush and commit
+        for entity, pk in session.info.pop(_FLUSHED, ()):
+            self.evict(entity, pk)
+
+    def _after_rollback(self, session: Session, previous_transaction) -> None:
+        self._after_transaction(session)
+
+    def _after_transaction_end(self, session: Session, transaction) -> None:
+        if transaction.parent is None:
+            session.info.pop(_BEGAN_AT, None)
+
+
+_second_level_cache: Optional[SecondLevelCache] = None
+
+
+def enable_second_level_cache(max_size: int = 10_000, ttl: float = 300.0) -> SecondLevelCache:
+    global _second_level_cache
+    if _second_level_cache is not None:
+        _second_level_cache.uninstall()
+    _second_level_cache = SecondLevelCache(max_size, ttl).install()
+    return _second_level_cache
+
+
+def disable_second_level_cache() -> None:
+    global _second_level_cache
+    if _second_level_cache is not None:
+        _second_level_cache.uninstall()
+        _second_level_cache = None
+
+
+def cached_get(session: Session, entity: Type, pk: Any) -> Optional[Any]:
+    """Like session.get(entity, pk), but served from the second-level cache when it is enabled and has the object."""
+    if _second_level_cache is not None:
+        instance = _second_level_cache.get(session, entity, pk)
+        if instance is not None:
+            return instance
+    return session.get(entity, pk)
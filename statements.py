@@ -0,0 +1,98 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+from sqlalchemy import bindparam, event, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from sqlalchemy.sql import Executable
+from core_metadata import user_table
+
+# Statement registry
+"""
+core.py and orm.py used to build a new text() object on every call, e.g.
+`conn.execute(text("INSERT INTO some_table (x, y) VALUES (:x, :y)"), ...)`. text() parses the SQL for :name
+parameters every time, and SQLAlchemy then computes the cache key of that new object to find its compiled form
+in the engine's compiled cache. The statements below are built once, at import, and every call passes the
+same object, so all that is left per call is the cache lookup.
+
+The some_table statements stay text() constructs: some_table is only reflected on first use (see
+core_metadata.get_some_table()), so Core expressions for it can't be built at import time, and core.py is also
+the tutorial for text(). The user_account lookup is a Core select(), like in core.py.
+
+With track_statement_cache(engine), every execution of a registered statement is counted as a hit or miss
+of the engine's compiled cache (a miss means SQLAlchemy had to compile the statement):
+
+`track_statement_cache(get_engine())`<br>
+`print(registry.stats())`
+
+See benchmarks.py statements for what building the statement per call costs.
+"""
+
+
+class StatementRegistry:
+    def __init__(self):
+        self.statements: Dict[str, Executable] = {}
+        self._names: Dict[int, str] = {}
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self._lock = threading.Lock()
+
+    def register(self, name: str, stmt: Executable) -> Executable:
+        if name in self.statements:
+            raise ValueError(f"A statement named {name!r} is already registered")
+        self.statements[name] = stmt
+        self._names[id(stmt)] = name
+        return stmt
+
+    def __getitem__(self, name: str) -> Executable:
+        return self.statements[name]
+
+    def name_of(self, stmt) -> Optional[str]:
+        return self._names.get(id(stmt))
+
+    def record(self, name: str, hit: bool) -> None:
+        with self._lock:
+            self._counters[name]["hits" if hit else "misses"] += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Compiled cache hits and misses per registered statement (only counted while tracked)."""
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+registry = StatementRegistry()
+
+CREATE_SOME_TABLE = registry.register(
+    "create_some_table", text("CREATE TABLE IF NOT EXISTS some_table (x int, y int)"))
+INSERT_INTO_SOME_TABLE = registry.register(
+    "insert_into_some_table", text("INSERT INTO some_table (x, y) VALUES (:x, :y)"))
+SELECT_ALL_FROM_SOME_TABLE_WHERE_X_IS = registry.register(
+    "select_all_from_some_table_where_x_is", text("SELECT * FROM some_table WHERE x = :x"))
+SELECT_X_Y_WHERE_Y_GREATER_THAN = registry.register(
+    "select_x_y_where_y_greater_than", text("SELECT x, y FROM some_table WHERE y > :y ORDER BY x, y"))
+UPDATE_SOME_TABLE_SET_Y_WHERE_X_IS = registry.register(
+    "update_some_table_set_y_where_x_is", text("UPDATE some_table SET y=:y WHERE x=:x"))
+DELETE_FROM_USER_ACCOUNT_WHERE_ID_IS = registry.register(
+    "delete_from_user_account_where_id_is", text("DELETE FROM user_account WHERE id = :user_id"))
+SELECT_ALL_FROM_USER_TABLE_WHERE_NAME_IS = registry.register(
+    "select_all_from_user_table_where_name_is", select(user_table).where(user_table.c.name == bindparam("name")))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    name = registry.name_of(context.invoked_statement)
+    if name is not None and context.cache_hit in (CACHE_HIT, CACHE_MISS):
+        registry.record(name, context.cache_hit is CACHE_HIT)
+
+
+def track_statement_cache(engine: Engine) -> None:
+    """Starts counting compiled cache hits and misses of the registered statements executed through `engine`."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+def untrack_statement_cache(engine: Engine) -> None:
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)